@@ -1,42 +1,139 @@
 import streamlit as st
-import whisper
 import os
+import json
 import tempfile
-from moviepy.editor import VideoFileClip, TextClip, CompositeVideoClip, vfx
-import random
-import string
-import shutil
-import numpy as np # For potential future image processing, useful with MoviePy sometimesimport streamlit as st
-from PIL import Image, ImageDraw, ImageFont
-import io
-import os
+import uuid
+from disk_cache import DEFAULT_CACHE_ROOT, DiskLRUCache
+from ingest import ingest_for_session, upload_key
+from transcription import TranscriptionCache, chunking_options
+from jobs import ACTIVE_STATUSES, CANCELLED, DONE, FAILED, MAX_CONCURRENT_JOBS, QUEUED, RUNNING, JobQueue, WorkerProcesses
+from clip_render import CUT_MODES, ENCODER_PRESETS, DEFAULT_ENCODER
+from render_cache import PROXY_CACHE_MAX_BYTES, PROXY_ENCODER, RENDER_CACHE_MAX_BYTES, RenderCache
+from segments import SegmentIndex
+from reframe import REFRAME_MODES
+from scoring import ENVELOPE_HOP_SECONDS, score_windows
+from media import probe
+from media_readers import reader_pool
+from whisper_backends import BACKENDS, DEFAULT_BACKEND_CONFIG, MODEL_SIZES, available_backends
+from artifacts import ArtifactStore
+from profiling import profiler, stage
+from text_render import PNG_COMPRESS_LEVEL, draw_text, load_font, preview_copy
+from pixelpy_batch import DEFAULT_SPEC, OUTPUT_FORMATS
+from PIL import Image
 
 st.set_page_config(page_title="PixelPy - Pixellab Alternative", layout="centered")
 
+# Generated files (edited images, rendered clips) live on disk and are served
+# by Streamlit's static endpoint, so sessions only hold short artifact tokens
+@st.cache_resource
+def get_artifact_store():
+    return ArtifactStore()
+
+artifact_store = get_artifact_store()
+artifact_store.purge_if_due() # Expire old artifacts / enforce the disk quota, about once a minute
+
+def show_download(token, file_name, label, mime):
+    # A link into the static endpoint when it will serve the file; beyond its
+    # size cap that would 404, so fall back to a download button fed from
+    # the open file
+    if artifact_store.servable(token):
+        st.markdown(artifact_store.download_link(token, file_name=file_name, label=label), unsafe_allow_html=True)
+    else:
+        with open(artifact_store.path(token), "rb") as f:
+            st.download_button(label, f, file_name=file_name, mime=mime, key=f"download_{token}")
+
+def show_zip_download(tokens, file_name, label):
+    # One download per part of a split zip (see artifacts.write_zip_parts)
+    for i, token in enumerate(tokens, 1):
+        if len(tokens) == 1:
+            show_download(token, file_name, label, "application/zip")
+        else:
+            show_download(token, f"{os.path.splitext(file_name)[0]}-{i}.zip",
+                          f"{label}, part {i} of {len(tokens)}", "application/zip")
+
+JOB_POLL_SECONDS = 1.0 # Refresh interval of the job status fragments
+
+# Background job queue + its worker processes, one set per server process.
+# Heavy work runs there; the script only submits jobs and polls their state.
+@st.cache_resource
+def get_worker_processes():
+    return WorkerProcesses()
+
+@st.cache_resource
+def get_shared_job_queue():
+    return JobQueue()
+
+def get_job_queue():
+    # Every access also replaces workers that died since the last one
+    get_worker_processes().ensure_running()
+    return get_shared_job_queue()
+
+def show_job_status(job, label):
+    # Progress bar + cancel button for a queued/running job; returns True while active
+    if job["status"] == QUEUED:
+        position = get_job_queue().queue_position(job["id"])
+        st.progress(0.0, text=f"{label}: waiting for a free worker ({position} job(s) ahead)")
+    elif job["status"] == RUNNING:
+        st.progress(job["progress"], text=f"{label}: {job['message'] or 'running'}")
+    else:
+        return False
+    if st.button("✖ Cancel", key=f"cancel_{job['id']}"):
+        get_job_queue().cancel(job["id"])
+        st.rerun()
+    return True
+
+# Only this fragment re-runs while its job is active, not the whole script;
+# once the job is over, one full rerun shows its result
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_status_fragment(job_id, label):
+    job = get_job_queue().get(job_id)
+    if job is None or not show_job_status(job, label):
+        st.rerun()
+
 st.title("🎨 PixelPy - Your Simple Image Editor")
 st.markdown("Upload an image, add text, and download your creation!")
 
 # --- Session State Initialization ---
-if 'original_image_bytes' not in st.session_state:
-    st.session_state.original_image_bytes = None
-if 'processed_image_bytes' not in st.session_state:
-    st.session_state.processed_image_bytes = None
+# Images are kept as artifact tokens (files on disk), not bytes in the session
+if 'original_image_token' not in st.session_state:
+    st.session_state.original_image_token = None
+if 'original_image_upload' not in st.session_state:
+    st.session_state.original_image_upload = None
+if 'processed_image_token' not in st.session_state:
+    st.session_state.processed_image_token = None
 if 'uploaded_file_name' not in st.session_state:
     st.session_state.uploaded_file_name = "output_image.png"
 
 # --- Image Upload ---
 uploaded_file = st.file_uploader("Choose an image file", type=["png", "jpg", "jpeg", "webp"])
 
-if uploaded_file is not None:
-    # Read the image bytes once and store in session state
-    st.session_state.original_image_bytes = uploaded_file.getvalue()
+# Written to disk once per upload (not on every rerun), and again if the
+# artifact store has expired or evicted it while the upload is still selected
+new_image_upload = uploaded_file is not None and st.session_state.original_image_upload != upload_key(uploaded_file)
+if new_image_upload or (uploaded_file is not None and not artifact_store.exists(st.session_state.original_image_token)):
+    fd, temp_path = tempfile.mkstemp(dir=artifact_store.root, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(uploaded_file.getbuffer())
+    st.session_state.original_image_token = artifact_store.add_file(temp_path, os.path.splitext(uploaded_file.name)[1] or "png")
+    st.session_state.original_image_upload = upload_key(uploaded_file)
     st.session_state.uploaded_file_name = uploaded_file.name
-    # Clear processed image bytes if a new image is uploaded
-    st.session_state.processed_image_bytes = None
+    if new_image_upload:
+        # Clear the processed image if a new image is uploaded
+        st.session_state.processed_image_token = None
 
 # --- Image Processing & Display ---
-if st.session_state.original_image_bytes is not None:
-    original_image = Image.open(io.BytesIO(st.session_state.original_image_bytes)).convert("RGBA")
+# Decoded once per file (and downscaled once for the live preview), not on every rerun
+@st.cache_resource(max_entries=4)
+def load_image(path):
+    return Image.open(path).convert("RGBA")
+
+@st.cache_resource(max_entries=4)
+def load_preview_image(path):
+    return preview_copy(load_image(path))
+
+if artifact_store.exists(st.session_state.original_image_token):
+    original_image_path = artifact_store.path(st.session_state.original_image_token)
+    original_image = load_image(original_image_path)
     
     st.subheader("Add Text to Your Image")
 
@@ -59,59 +156,84 @@ if st.session_state.original_image_bytes is not None:
     text_x = int(img_width * pos_x_percent / 100)
     text_y = int(img_height * pos_y_percent / 100)
 
+    # Fonts are cached; a missing arial.ttf falls back to Pillow's built-in font
+    if not load_font(font_size)[1]:
+        st.warning("Could not find 'arial.ttf'. Using default PIL font.")
+
     # --- Apply Text Button ---
     if st.button("Apply Text"):
-        processed_image = original_image.copy()
-        draw = ImageDraw.Draw(processed_image)
-
-        # Attempt to load a default font (Streamlit Cloud usually has common fonts)
-        # You might need to specify a path to a .ttf file for more control
-        try:
-            # Using a generic font that should be available on most systems/Streamlit Cloud
-            font = ImageFont.truetype("arial.ttf", font_size) 
-        except IOError:
-            st.warning("Could not find 'arial.ttf'. Using default PIL font (may not scale well).")
-            font = ImageFont.load_default()
-            font_size = 16 # Reset font size for default font as it doesn't scale with number
-
-        # Calculate text bounding box to center text if needed
-        # xy=(x,y), anchor="ms" means (x,y) is the middle-bottom of the text
-        # xy=(x,y), anchor="mm" means (x,y) is the middle-middle of the text
-        
-        # Draw the text with a black outline for better visibility
-        outline_color = (0, 0, 0) # Black
-        outline_width = 2
-        
-        for x_offset in range(-outline_width, outline_width + 1):
-            for y_offset in range(-outline_width, outline_width + 1):
-                if x_offset != 0 or y_offset != 0: # Don't draw main text again
-                    draw.text((text_x + x_offset, text_y + y_offset), text_input, font=font, fill=outline_color, anchor="mm")
-
-        # Draw the main text
-        draw.text((text_x, text_y), text_input, font=font, fill=text_color, anchor="mm")
-
-
-        # Convert processed image back to bytes for storage and download
-        buffered = io.BytesIO()
-        processed_image.save(buffered, format="PNG") # Save as PNG to support transparency
-        st.session_state.processed_image_bytes = buffered.getvalue()
-        st.success("Text applied successfully! See preview below.")
+        # Text centred on (text_x, text_y) with a black outline drawn in the
+        # same pass; only the text's box is composited onto the full-size image
+        with stage("pixelpy_draw"):
+            processed_image = draw_text(original_image, text_input, (text_x, text_y), font_size, text_color)
+
+        # Save the processed image straight into the artifact store
+        processed_token = artifact_store.new_token("png")
+        with stage("pixelpy_encode"):
+            processed_image.save(artifact_store.path(processed_token), format="PNG", compress_level=PNG_COMPRESS_LEVEL) # Save as PNG to support transparency
+        st.session_state.processed_image_token = processed_token
+        st.success("Text applied successfully! Download it below.")
 
     # --- Display Preview ---
-    if st.session_state.processed_image_bytes is not None:
-        st.subheader("Preview")
-        st.image(st.session_state.processed_image_bytes, caption="Your edited image", use_column_width=True)
-
-        # --- Download Button ---
-        st.download_button(
-            label="Download Edited Image",
-            data=st.session_state.processed_image_bytes,
+    # Drawn live on a downscaled copy from the cached text layers, so moving
+    # the sliders stays interactive even for very large photos
+    st.subheader("Preview")
+    preview_image, preview_scale = load_preview_image(original_image_path)
+    st.image(draw_text(preview_image, text_input, (text_x * preview_scale, text_y * preview_scale),
+                       max(1, round(font_size * preview_scale)), text_color),
+             caption="Your edited image", use_column_width=True)
+
+    if artifact_store.exists(st.session_state.processed_image_token):
+        # --- Download Link (streamed from disk by the static endpoint) ---
+        show_download(
+            st.session_state.processed_image_token,
             file_name=f"pixelpy_{st.session_state.uploaded_file_name}",
-            mime="image/png"
+            label="Download Edited Image", mime="image/png"
         )
-    else:
-        st.subheader("Original Image Preview")
-        st.image(st.session_state.original_image_bytes, caption="Original Image", use_column_width=True)
+
+    # --- Batch Mode ---
+    # The same overlay on many images at once, rendered by a background job
+    # (`python pixelpy_batch.py` does the same headless, e.g. with a CSV of per-image text)
+    with st.expander("📚 Apply to Many Images"):
+        batch_files = st.file_uploader("Images", type=["png", "jpg", "jpeg", "webp"], accept_multiple_files=True)
+        batch_format = st.selectbox("Output format", list(OUTPUT_FORMATS))
+        batch_quality = st.slider("Quality (WebP/JPEG)", 10, 100, 90)
+        if st.button("Apply Text to All", disabled=not batch_files):
+            batch_spec = {**DEFAULT_SPEC, "text": text_input, "x": pos_x_percent, "y": pos_y_percent,
+                          "font_size": font_size, "color": text_color}
+            # Inputs go to disk under index names (uploads may share a name);
+            # the images are rendered by a background job, which zips them
+            batch_root = os.path.join(DEFAULT_CACHE_ROOT, "pixelpy_batches")
+            os.makedirs(batch_root, exist_ok=True)
+            batch_dir = tempfile.mkdtemp(dir=batch_root)
+            batch_images = []
+            for i, batch_file in enumerate(batch_files):
+                file_name = f"{i:04d}{os.path.splitext(batch_file.name)[1].lower()}"
+                with open(os.path.join(batch_dir, file_name), "wb") as f:
+                    f.write(batch_file.getbuffer())
+                batch_images.append((file_name, os.path.basename(batch_file.name)))
+            batch_zip_token = artifact_store.new_token("zip")
+            batch_job_id = get_job_queue().submit("pixelpy_batch", {
+                "batch_dir": batch_dir, "images": batch_images, "spec": batch_spec,
+                "format": batch_format, "quality": batch_quality,
+                "output_path": artifact_store.path(batch_zip_token),
+            }, owner=st.session_state.session_id)
+            st.session_state.batch_job = batch_job_id
+        if st.session_state.get('batch_job'):
+            batch_job_id = st.session_state.batch_job
+            batch_job = get_job_queue().get(batch_job_id) or {"status": None}
+            if batch_job["status"] in ACTIVE_STATUSES:
+                job_status_fragment(batch_job_id, "Batch")
+            elif batch_job["status"] == DONE:
+                for name, error in batch_job["result"]["failed"]:
+                    st.warning(f"Skipped {name}: {error}")
+                zip_parts = batch_job["result"]["zip_parts"]
+                if zip_parts and all(artifact_store.exists(token) for token in zip_parts):
+                    show_zip_download(zip_parts, file_name="pixelpy_batch.zip", label="📦 Download All (.zip)")
+            elif batch_job["status"] == FAILED:
+                st.error(f"Batch failed: {batch_job['error']}")
+            elif batch_job["status"] == CANCELLED:
+                st.warning("Batch cancelled.")
 
 else:
     st.info("Upload an image to start editing!")
@@ -126,68 +248,69 @@ st.set_page_config(page_title="AI Clip Generator", layout="wide")
 
 st.title("🎬 AI Clip Generator (Opus Clip Alternative)")
 st.markdown("Upload your video to extract, caption, and format engaging clips!")
-st.warning("⚠️ **Important:** 'Engaging part' detection is based on a simple heuristic (longest speech segments) and will not be as intelligent or accurate as commercial tools like Opus Clip. Processing on free hosting (Streamlit Community Cloud) will be slow and may have limitations (e.g., timeouts, memory errors) for longer videos due to resource intensity.")
+st.warning("⚠️ **Important:** 'Engaging part' detection is based on simple heuristics (speech rate, pauses, loudness, keywords) and will not be as intelligent or accurate as commercial tools like Opus Clip. Processing on free hosting (Streamlit Community Cloud) will be slow and may have limitations (e.g., timeouts, memory errors) for longer videos due to resource intensity.")
 
 # --- Helper Functions ---
-def random_filename(ext="mp4"):
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=10)) + f".{ext}"
+WHISPER_OPTIONS = {} # Extra kwargs for the backend's transcribe call (part of the cache key)
+UPLOAD_STORE_MAX_BYTES = 20 * 1024 ** 3 # 20 GiB of uploaded videos
+LIVE_TRANSCRIPT_LINES = 5 # Latest segments shown while a video is being transcribed
 
-# Whisper model (cached for performance)
+# Transcripts are cached on disk by content hash, so reruns, new sessions and
+# restarts skip Whisper entirely for a video that was already transcribed
 @st.cache_resource
-def load_whisper_model():
-    with st.spinner("Loading AI transcription model... (This might take a moment the first time)"):
-        # Using a smaller model like 'base' for faster loading and lower memory usage
-        # 'tiny' is even smaller, 'small', 'medium', 'large' are larger/slower but more accurate.
-        return whisper.load_model("base") 
-
-# Function to transcribe the entire video and return all segments
-def transcribe_full_video(video_path):
-    st.info("Transcribing entire video for segment analysis...")
-    temp_audio_path = os.path.join(tempfile.gettempdir(), random_filename(ext="mp3"))
-    try:
-        video_clip = VideoFileClip(video_path)
-        audio_clip = video_clip.audio
-        audio_clip.write_audiofile(temp_audio_path)
-        
-        # Perform transcription
-        result = whisper_model.transcribe(temp_audio_path)
-        return result["segments"]
-    except Exception as e:
-        st.error(f"Error during full video audio extraction or transcription: {e}")
-        return []
-    finally:
-        if os.path.exists(temp_audio_path):
-            os.remove(temp_audio_path)
-
-# Function to automatically find "engaging" clips based on heuristics
-def find_engaging_clips(segments, video_duration, num_clips=3, min_clip_duration=10):
-    st.info(f"Looking for engaging clips (longest speech segments)...")
-    candidate_clips = []
-    
-    # Filter segments that are primarily speech and of a reasonable length
-    for i, segment in enumerate(segments):
-        # Calculate the actual duration of the transcribed speech within the segment
-        segment_speech_duration = segment["end"] - segment["start"]
-        
-        # Consider segments with actual speech duration > min_clip_duration
-        if segment_speech_duration >= min_clip_duration:
-            candidate_clips.append({
-                "start": segment["start"],
-                "end": segment["end"],
-                "duration": segment_speech_duration,
-                "text": segment["text"] # Store text for context
-            })
-            
-    # Sort candidates by duration (longest first)
-    candidate_clips.sort(key=lambda x: x["duration"], reverse=True)
-    
-    # Select top N clips
+def get_transcription_cache():
+    return TranscriptionCache()
+
+# Uploads are kept on disk by content hash so background jobs can read them
+# after this script run ends; the ones active jobs still read are never evicted
+@st.cache_resource
+def get_upload_store():
+    return DiskLRUCache(os.path.join(DEFAULT_CACHE_ROOT, "uploads"), UPLOAD_STORE_MAX_BYTES,
+                        pinned=lambda: get_shared_job_queue().active_video_paths())
+
+# Full-quality clips, cached on disk per clip range + settings, so pressing
+# Generate again only renders the clips that changed
+@st.cache_resource
+def get_render_cache():
+    return RenderCache("renders", RENDER_CACHE_MAX_BYTES)
+
+# Low-res clip previews, cached on disk per clip range + settings
+@st.cache_resource
+def get_proxy_cache():
+    return RenderCache("proxies", PROXY_CACHE_MAX_BYTES)
+
+# Same for the transcribe job, plus the transcript so far, which the job
+# writes to the transcript cache as each chunk finishes
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def transcription_status_fragment(job_id, video_hash, backend_config, cache_options):
+    job = get_job_queue().get(job_id)
+    if job is None or not show_job_status(job, "Transcribing video"):
+        st.rerun()
+    partial = get_transcription_cache().get_partial(video_hash, backend_config, cache_options) or []
+    for segment in partial[-LIVE_TRANSCRIPT_LINES:]:
+        st.caption(f"[{segment['start']:.1f}s] {segment['text'].strip()}")
+
+def reset_clip_editor():
+    # Drop the clip editor widgets' state so they show the current clips_data
+    for key in [k for k in st.session_state if k.startswith(("clip_name_", "start_time_", "end_time_"))]:
+        del st.session_state[key]
+
+# Function to automatically find "engaging" clips: windows of consecutive
+# segments scored on speech rate, pauses, loudness and keyword hits (see scoring.py)
+def find_engaging_clips(segments, video_duration, num_clips=3, min_clip_duration=10,
+                        max_clip_duration=60, envelope=None, keywords=()):
+    st.info(f"Looking for engaging clips (dense, loud, keyword-rich speech)...")
+    with stage("find_engaging_clips"):
+        windows = score_windows(segments, min_duration=min_clip_duration, max_duration=max_clip_duration,
+                                num_clips=num_clips, envelope=envelope, hop_seconds=ENVELOPE_HOP_SECONDS,
+                                keywords=keywords)
+
     engaging_clips = []
-    for i, clip_data in enumerate(candidate_clips[:num_clips]):
+    for i, window in enumerate(windows):
         engaging_clips.append({
-            "start_time": clip_data["start"],
-            "end_time": clip_data["end"],
-            "name": f"Auto-Clip {i+1} (approx. {clip_data['duration']:.1f}s)"
+            "start_time": window["start"],
+            "end_time": min(window["end"], video_duration),
+            "name": f"Auto-Clip {i+1} (approx. {window['duration']:.1f}s)"
         })
     
     if not engaging_clips:
@@ -198,163 +321,139 @@ def find_engaging_clips(segments, video_duration, num_clips=3, min_clip_duration
     return engaging_clips
 
 
-def add_captions_and_process_clip(
-    video_path, all_segments, clip_start, clip_end,
-    font_size=24, font_color="white",
-    aspect_ratio="original", clip_name="output_clip"
-):
-    st.info(f"Processing clip '{clip_name}' with captions and formatting...")
-    try:
-        full_video = VideoFileClip(video_path)
-        clip = full_video.subclip(clip_start, clip_end)
-    except Exception as e:
-        st.error(f"Error loading or sub-clipping video: {e}")
-        return None
-
-    # Update clip size after aspect ratio adjustments
-    current_width, current_height = clip.size
-    final_width, final_height = current_width, current_height
-
-    # 1. Handle Aspect Ratio
-    if aspect_ratio == "9:16": # Vertical - for Shorts, Reels, TikTok
-        target_height = int(current_width * 16 / 9)
-        if target_height > current_height: # Original is too short, pad height
-            final_width, final_height = current_width, target_height
-            clip = clip.resize(height=target_height)
-            # Create a black background and composite the resized video
-            bg_clip = VideoFileClip(clip.filename, size=(final_width, final_height), bg_color=(0,0,0)).set_duration(clip.duration)
-            clip = CompositeVideoClip([clip.set_position(("center", "center"))], size=(final_width, final_height))
-        else: # Original is too wide, crop width
-            target_width = int(current_height * 9 / 16)
-            clip = clip.crop(x_center=current_width/2, y_center=current_height/2, width=target_width, height=current_height)
-            final_width, final_height = clip.size # Update final dimensions after crop
-
-    elif aspect_ratio == "1:1": # Square
-        side = min(current_width, current_height)
-        if current_width != current_height: # Only crop if not already square
-            clip = clip.crop(x_center=current_width/2, y_center=current_height/2, width=side, height=side)
-        final_width, final_height = clip.size
-
-    elif aspect_ratio == "16:9": # Standard landscape
-        target_width = int(current_height * 16 / 9)
-        if target_width > current_width: # Original is too narrow, pad width
-            final_width, final_height = target_width, current_height
-            clip = clip.resize(width=target_width)
-            # Create a black background and composite the resized video
-            bg_clip = VideoFileClip(clip.filename, size=(final_width, final_height), bg_color=(0,0,0)).set_duration(clip.duration)
-            clip = CompositeVideoClip([clip.set_position(("center", "center"))], size=(final_width, final_height))
-        else: # Original is too tall, crop height
-            target_height = int(current_width * 9 / 16)
-            clip = clip.crop(x_center=current_width/2, y_center=current_height/2, width=current_width, height=target_height)
-            final_width, final_height = clip.size # Update final dimensions after crop
-    
-    # 2. Add Captions
-    caption_clips = []
-    # Filter segments that fall within the current clip's time range
-    # and adjust their times to be relative to the start of the current `clip`
-    
-    # Ensure all_segments are sorted by start time for easier processing
-    all_segments.sort(key=lambda s: s["start"])
-
-    for segment in all_segments:
-        # Check if the segment overlaps with the current clip
-        if max(clip_start, segment["start"]) < min(clip_end, segment["end"]):
-            # Calculate the portion of the segment that is within the current clip
-            segment_in_clip_start = max(clip_start, segment["start"])
-            segment_in_clip_end = min(clip_end, segment["end"])
-            
-            # Calculate relative start and end times for the current subclip
-            relative_start = segment_in_clip_start - clip_start
-            relative_end = segment_in_clip_end - clip_start
-            
-            caption_text = str(segment["text"]).strip()
-            if not caption_text or relative_end <= relative_start: # Skip empty text or zero-duration
-                continue
-
-            try:
-                caption = TextClip(caption_text, 
-                                   fontsize=font_size, 
-                                   color=font_color, 
-                                   size=(final_width * 0.9, None), # Max 90% width, auto height
-                                   method='caption', 
-                                   align='center',
-                                   stroke_color='black', 
-                                   stroke_width=1.5,
-                                   font="Arial" # Specify a common font
-                                  )
-                caption = caption.set_start(relative_start).set_duration(relative_end - relative_start)
-                caption = caption.set_position(("center", final_height * 0.85)) # Position near bottom
-                caption_clips.append(caption)
-            except Exception as e:
-                st.warning(f"Could not create text clip for segment '{caption_text}': {e}")
-                continue
-
-    final_video = CompositeVideoClip([clip] + caption_clips, size=(final_width, final_height))
-    
-    # Create a unique temporary directory for each output clip
-    output_dir = tempfile.mkdtemp()
-    temp_out_path = os.path.join(output_dir, random_filename(ext="mp4"))
-
-    try:
-        # Use a more robust codec and lower preset for faster rendering on limited resources
-        final_video.write_videofile(temp_out_path, codec="libx264", audio_codec="aac", fps=clip.fps, preset="medium", threads=1)
-        return temp_out_path
-    except Exception as e:
-        st.error(f"Error writing output video for '{clip_name}': {e}")
-        st.error("This could be due to an issue with FFmpeg, video codecs, or insufficient disk space.")
-        st.info("Try a shorter video or simpler settings if you encounter this frequently.")
-        return None
-    finally:
-        pass # We will clean up in the main app logic after download
-
 # --- Streamlit UI ---
 input_col, preview_col = st.columns([1, 2])
 
-# --- Global variables for cleanup ---
 video_path = None
-temp_file_dirs = [] # Store directories to clean up later
-full_video_segments = [] # To store transcription results
+full_video_segments = [] # Transcript of the video uploaded in this run (never a previous one)
+segment_index = None
+
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 with input_col:
     st.header("1. Upload Video")
+
+    # Transcription engine for this job. Smaller models and int8 engines are
+    # faster and lighter; larger ones are more accurate (`python benchmarks.py
+    # backends` measures real-time factor and peak memory on this machine).
+    with st.expander("🗣️ Transcription Model"):
+        installed_backends = available_backends() or [DEFAULT_BACKEND_CONFIG["backend"]]
+        backend_name = st.selectbox("Backend", installed_backends)
+        model_size = st.selectbox("Model size", MODEL_SIZES, index=MODEL_SIZES.index(DEFAULT_BACKEND_CONFIG["model_size"]))
+        compute_type = st.selectbox("Compute type", BACKENDS[backend_name].compute_types)
+    backend_config = {"backend": backend_name, "model_size": model_size, "compute_type": compute_type}
+
     uploaded_file = st.file_uploader("Upload your video file", type=["mp4", "mov", "avi", "mkv"])
     
     if uploaded_file:
-        temp_dir = tempfile.mkdtemp()
-        temp_path = os.path.join(temp_dir, uploaded_file.name)
-        with open(temp_path, "wb") as f:
-            f.write(uploaded_file.read())
-        video_path = temp_path
-        temp_file_dirs.append(temp_dir)
+        # Streamed to disk in chunks while hashing, deduplicated by hash, and
+        # remembered for the session so reruns neither re-hash nor re-write it
+        with stage("ingest_upload"):
+            video_hash, video_path = ingest_for_session(uploaded_file, get_upload_store(), st.session_state)
         st.success("Video uploaded successfully!")
 
-        # Transcribe the entire video immediately after upload for segment analysis
-        with st.spinner("Transcribing video for engaging clip detection..."):
-            full_video_segments = transcribe_full_video(video_path)
-            st.session_state['full_video_segments'] = full_video_segments
-            
+        # Transcribe the entire video after upload for segment analysis. The
+        # transcript comes from the on-disk cache when these bytes were seen
+        # before; otherwise a background job produces it while we poll.
+        transcription_cache = get_transcription_cache()
+        cache_options = {**WHISPER_OPTIONS, **chunking_options()}
+        full_video_segments = transcription_cache.get(video_hash, backend_config, cache_options)
+        if full_video_segments is None:
+            transcript_key = f"{video_hash}:{json.dumps(backend_config, sort_keys=True)}"
+            transcribe_jobs = st.session_state.setdefault('transcribe_jobs', {})
+            job = get_job_queue().get(transcribe_jobs[transcript_key]) if transcript_key in transcribe_jobs else None
+            if job is None:
+                job_id = get_job_queue().submit("transcribe", {
+                    "video_path": video_path,
+                    "video_hash": video_hash,
+                    "backend_config": backend_config,
+                    "whisper_options": WHISPER_OPTIONS,
+                    "cache_options": cache_options,
+                }, owner=st.session_state.session_id)
+                transcribe_jobs[transcript_key] = job_id
+                job = get_job_queue().get(job_id)
+
+            if job["status"] in ACTIVE_STATUSES:
+                transcription_status_fragment(job["id"], video_hash, backend_config, cache_options)
+            else:
+                if job["status"] == FAILED:
+                    st.error(f"Error during full video audio extraction or transcription: {job['error']}")
+                elif job["status"] == CANCELLED:
+                    st.warning("Transcription cancelled.")
+                else: # Done, but the transcript has since been evicted from the cache
+                    st.warning("The transcript for this video is no longer cached.")
+                if st.button("🔁 Retry Transcription"):
+                    del transcribe_jobs[transcript_key]
+                    st.rerun()
+
+        # Clips suggested for (or added to) a previous video don't apply to this one
+        if st.session_state.get('clips_video_hash') != video_hash:
+            st.session_state.clips_data = []
+            st.session_state.clips_video_hash = video_hash
+            reset_clip_editor()
+
+        if full_video_segments is not None:
+            # Build the caption lookup index once per transcript, not per clip.
+            # Only used when its key matches, so a new upload never gets the
+            # previous video's captions while its own transcript is pending.
+            transcript_key = (video_hash, tuple(sorted(backend_config.items())))
+            if st.session_state.get('segment_index_key') != transcript_key:
+                st.session_state['segment_index'] = SegmentIndex(full_video_segments)
+                st.session_state['segment_index_key'] = transcript_key
+            segment_index = st.session_state['segment_index']
+
             # Autogenerate engaging clips suggestions
-            video_duration = VideoFileClip(video_path).duration
-            suggested_clips = find_engaging_clips(full_video_segments, video_duration)
-            
+            with st.expander("✨ Clip Suggestions"):
+                duration_range = st.slider("Clip length (seconds)", 5, 120, (10, 60), step=5)
+                keywords_text = st.text_input("Keywords to look for (comma-separated)",
+                                              help="Phrases like 'free trial' count when their words are spoken in a row.")
+                refresh_suggestions = st.button("🔄 Replace Clips With New Suggestions")
+            keywords = tuple(k.strip() for k in keywords_text.split(",") if k.strip())
+
+            # Duration comes from one cached ffprobe call, no decoder is opened
+            video_duration = probe(video_path)["duration"]
+            # The loudness envelope is written by the transcribe job; older
+            # cache entries may not have one, then only transcript features count
+            envelope = transcription_cache.get_envelope(video_hash, ENVELOPE_HOP_SECONDS)
+
             # Initialize or update session state for clips data
-            if 'clips_data' not in st.session_state or not st.session_state.clips_data:
-                 st.session_state.clips_data = suggested_clips
-            else:
-                 # If user has already added clips, just add suggestions
-                 # Or you could replace them based on a button click
-                 pass # For now, let's keep it simple and just populate if empty
+            if refresh_suggestions:
+                reset_clip_editor()
+            if 'clips_data' not in st.session_state or not st.session_state.clips_data or refresh_suggestions:
+                 st.session_state.clips_data = find_engaging_clips(
+                     full_video_segments, video_duration, min_clip_duration=duration_range[0],
+                     max_clip_duration=duration_range[1], envelope=envelope, keywords=keywords)
 
 if video_path:
     with preview_col:
         st.header("2. Video Preview & Clip Selection")
-        st.video(video_path)
+        # A small player copy of the upload, rendered once per video by a
+        # background job and kept in the proxy cache; st.video on the upload
+        # itself would read and hash the whole file on every rerun
+        source_preview_key = RenderCache.source_preview_key(video_hash)
+        source_preview_path = get_proxy_cache().get(source_preview_key)
+        if source_preview_path is not None:
+            st.video(source_preview_path)
+        else:
+            source_preview_jobs = st.session_state.setdefault('source_preview_jobs', {})
+            job = (get_job_queue().get(source_preview_jobs[source_preview_key])
+                   if source_preview_key in source_preview_jobs else None)
+            if job is None or job["status"] == DONE: # Not rendered yet, or evicted since
+                source_preview_jobs[source_preview_key] = get_job_queue().submit(
+                    "source_preview", {"key": source_preview_key, "video_path": video_path},
+                    owner=st.session_state.session_id)
+                job = get_job_queue().get(source_preview_jobs[source_preview_key])
+            if job["status"] in ACTIVE_STATUSES:
+                job_status_fragment(job["id"], "Video preview")
+            elif job["status"] == FAILED:
+                st.error(f"Video preview failed: {job['error']}")
+            elif job["status"] == CANCELLED:
+                st.caption("Video preview cancelled.")
         
         # Display full video duration
-        video_clip_for_duration = VideoFileClip(video_path)
-        full_duration = video_clip_for_duration.duration
+        full_duration = probe(video_path)["duration"]
         st.info(f"Full video duration: {full_duration:.2f} seconds")
-        video_clip_for_duration.close() # Release the file
 
         st.markdown("---")
         st.subheader("Define Your Clips:")
@@ -420,71 +519,190 @@ if video_path:
         "9:16 (Vertical)": "9:16"
     }
     selected_aspect_ratio = aspect_ratio_map[aspect_ratio_option]
+    # How the frame is fitted to that ratio (runs in ffmpeg's filter graph)
+    reframe_mode = st.selectbox(
+        "Reframing", list(REFRAME_MODES), format_func=REFRAME_MODES.get,
+        disabled=selected_aspect_ratio == "original",
+        help="Smart crop follows faces when OpenCV is installed, otherwise the centre of motion."
+    )
+
+    with st.expander("⚙️ Render Performance"):
+        # Clips render as background jobs, at most MAX_CONCURRENT_JOBS at a time
+        # across all users; cap ffmpeg threads per clip so jobs x threads
+        # roughly matches the number of cores
+        core_count = os.cpu_count() or 1
+        st.caption(f"Up to {MAX_CONCURRENT_JOBS} clip(s) render in parallel on this server.")
+        ffmpeg_threads = st.number_input("FFmpeg threads per clip", min_value=1, max_value=core_count,
+                                         value=max(1, core_count // MAX_CONCURRENT_JOBS), step=1)
+        encoder_preset = st.selectbox("Encoder preset (faster = bigger files)", ENCODER_PRESETS,
+                                      index=ENCODER_PRESETS.index(DEFAULT_ENCODER["preset"]))
+        # Clips kept at the original aspect ratio with no captions can skip the full transcode
+        cut_mode = st.selectbox("Fast path for uncaptioned 'original' clips", list(CUT_MODES),
+                                format_func=CUT_MODES.get, index=list(CUT_MODES).index(DEFAULT_ENCODER["cut_mode"]))
+    encoder_settings = {"preset": encoder_preset, "threads": int(ffmpeg_threads), "cut_mode": cut_mode}
+
+    def clip_render_params(clip_data, encoder):
+        # Shared by previews and the export, so a preview shows what will be rendered
+        return {
+            "video_path": video_path,
+            # Only this clip's captions are shipped to the worker
+            "captions": segment_index.query(clip_data["start_time"], clip_data["end_time"]),
+            "clip_start": clip_data["start_time"],
+            "clip_end": clip_data["end_time"],
+            "font_size": font_size,
+            "font_color": font_color,
+            "aspect_ratio": selected_aspect_ratio,
+            "reframe": reframe_mode,
+            "encoder": encoder,
+        }
+
+    st.header("4. Preview & Export")
+    # Low-res proxies with the same captions and reframing as the export, cached
+    # per clip range + settings: editing one clip only re-renders its preview
+    if full_video_segments and st.checkbox("👁️ Show 360p previews of the clips"):
+        proxy_cache = get_proxy_cache()
+        proxy_jobs = st.session_state.setdefault('proxy_jobs', {})
+        wanted_keys = set()
+        for clip_data in st.session_state.clips_data:
+            if clip_data["start_time"] >= clip_data["end_time"]:
+                continue
+            proxy_params = clip_render_params(clip_data, PROXY_ENCODER)
+            proxy_key = RenderCache.key(video_hash, proxy_params)
+            wanted_keys.add(proxy_key)
+            st.markdown(f"**{clip_data['name']}**")
+            proxy_path = proxy_cache.get(proxy_key)
+            if proxy_path is not None:
+                st.video(proxy_path)
+                continue
+            job = get_job_queue().get(proxy_jobs[proxy_key]) if proxy_key in proxy_jobs else None
+            if job is None or job["status"] == DONE: # Not rendered yet, or evicted since
+                proxy_jobs[proxy_key] = get_job_queue().submit(
+                    "proxy", {"key": proxy_key, "render": proxy_params}, owner=st.session_state.session_id)
+                job = get_job_queue().get(proxy_jobs[proxy_key])
+            if job["status"] in ACTIVE_STATUSES:
+                job_status_fragment(job["id"], "Preview")
+            elif job["status"] == FAILED:
+                st.error(f"Preview failed: {job['error']}")
+            elif job["status"] == CANCELLED:
+                st.caption("Preview cancelled.")
+        # Previews for ranges/settings that have since changed are not needed anymore
+        for proxy_key in [k for k in proxy_jobs if k not in wanted_keys]:
+            job = get_job_queue().get(proxy_jobs.pop(proxy_key))
+            if job and job["status"] in ACTIVE_STATUSES:
+                get_job_queue().cancel(job["id"])
 
 
     if st.button("✨ Generate All Clips"):
         if not st.session_state.clips_data:
             st.error("Please add at least one clip to generate.")
-        elif 'full_video_segments' not in st.session_state or not st.session_state['full_video_segments']:
-            st.error("Video transcription not complete or failed. Please re-upload the video.")
+        elif not full_video_segments:
+            st.error("The transcript of this video is not ready yet (or transcription failed).")
         else:
-            with st.spinner("Generating clips... This may take a while depending on video length and number of clips."):
-                generated_clips_paths = []
-                all_segments_for_processing = st.session_state['full_video_segments']
-
-                for i, clip_data in enumerate(st.session_state.clips_data):
-                    clip_start = clip_data["start_time"]
-                    clip_end = clip_data["end_time"]
-                    clip_name = clip_data["name"]
-
-                    if clip_start >= clip_end:
-                        st.error(f"Skipping '{clip_name}': Invalid time range (End time must be greater than start time).")
+            # Stop the previous batch if it is still going; its finished files
+            # simply expire from the artifact store
+            for _, job_id, _ in st.session_state.get('render_jobs', []):
+                previous = get_job_queue().get(job_id) if job_id is not None else None
+                if previous and previous["status"] in ACTIVE_STATUSES:
+                    get_job_queue().cancel(job_id)
+            st.session_state.clips_bundle_tokens = None
+
+            render_jobs = []
+            for i, clip_data in enumerate(st.session_state.clips_data):
+                clip_start = clip_data["start_time"]
+                clip_end = clip_data["end_time"]
+                clip_name = clip_data["name"]
+
+                if clip_start >= clip_end:
+                    st.error(f"Skipping '{clip_name}': Invalid time range (End time must be greater than start time).")
+                    continue
+
+                # Clips rendered before with the same range and settings come
+                # straight from the render cache (renaming a clip doesn't count)
+                render_params = clip_render_params(clip_data, encoder_settings)
+                cache_key = RenderCache.key(video_hash, render_params)
+                cached_path = get_render_cache().get(cache_key)
+                if cached_path is not None:
+                    try:
+                        render_jobs.append((clip_name, None, artifact_store.add_file(cached_path, "mp4", link=True)))
                         continue
-
-                    output_clip_path = add_captions_and_process_clip(
-                        video_path, all_segments_for_processing, clip_start, clip_end,
-                        font_size, font_color, selected_aspect_ratio, clip_name
-                    )
-                    if output_clip_path:
-                        generated_clips_paths.append((clip_name, output_clip_path))
-                    else:
-                        st.error(f"Failed to process clip: '{clip_name}'")
-
-                if generated_clips_paths:
-                    st.success("All selected clips generated!")
-                    st.subheader("Download Your Clips:")
-                    for clip_name, path in generated_clips_paths:
-                        with open(path, "rb") as file:
-                            st.download_button(
-                                label=f"📥 Download '{clip_name}.mp4'",
-                                data=file,
-                                file_name=f"{clip_name}.mp4",
-                                mime="video/mp4",
-                                key=f"download_{clip_name}"
-                            )
-                        # Clean up the individual output clip file and its temporary directory
-                        if os.path.exists(path):
-                            os.remove(path)
-                        # Remove the parent directory of the generated clip
-                        # Make sure not to remove the main temp_dir if other files are there
-                        if os.path.exists(os.path.dirname(path)) and os.path.isdir(os.path.dirname(path)):
-                             try:
-                                 shutil.rmtree(os.path.dirname(path))
-                             except OSError as e:
-                                 st.warning(f"Error cleaning up output temporary directory {os.path.dirname(path)}: {e}")
-
+                    except FileNotFoundError: # Evicted in the meantime: render it again
+                        pass
+
+                # The worker renders into the render cache and links the result into the artifact store
+                output_token = artifact_store.new_token("mp4")
+                job_id = get_job_queue().submit("render", {
+                    **render_params,
+                    "output_path": artifact_store.path(output_token),
+                    "cache_key": cache_key,
+                }, owner=st.session_state.session_id)
+                render_jobs.append((clip_name, job_id, output_token))
+            st.session_state.render_jobs = render_jobs
+
+    # --- Render job status & downloads (polled on every rerun) ---
+    if st.session_state.get('render_jobs'):
+        st.subheader("Your Clips:")
+        finished_clips = []
+        batch_active = False
+        for i, (clip_name, job_id, output_token) in enumerate(st.session_state.render_jobs):
+            if job_id is None: # Served from the render cache, no job
+                job = {"status": DONE}
+            else:
+                job = get_job_queue().get(job_id)
+                if job is None:
+                    continue
+            if job["status"] in ACTIVE_STATUSES:
+                job_status_fragment(job["id"], f"'{clip_name}'")
+                batch_active = True
+            elif job["status"] == DONE:
+                if job_id is not None:
+                    st.session_state.setdefault('worker_reader_stats', {})[job["worker_pid"]] = job["result"].get("reader_stats")
+                    for warning in job["result"]["warnings"]:
+                        st.warning(f"'{clip_name}': {warning}")
+                if artifact_store.exists(output_token):
+                    finished_clips.append((output_token, f"{clip_name}.mp4"))
+                    show_download(output_token, file_name=f"{clip_name}.mp4",
+                                  label=f"📥 Download '{clip_name}.mp4'", mime="video/mp4")
                 else:
-                    st.warning("No clips were successfully generated.")
-
-
-# --- Cleanup of input temporary files (important for resource management) ---
-# This part runs whenever the script is re-executed (e.g., on widget interaction).
-# For a more robust cleanup in a deployed app, consider using st.session_state to track files
-# and clean them up when the user leaves the session or starts a new upload.
-# For simplicity here, we rely on tempfile's general cleanup and Streamlit's session behavior.
-for d_path in temp_file_dirs:
-    if os.path.exists(d_path):
-        try:
-            shutil.rmtree(d_path)
-        except OSError as e:
-            st.warning(f"Error cleaning up input temporary directory {d_path}: {e}")
+                    st.warning(f"'{clip_name}' has expired, please generate it again.")
+            elif job["status"] == FAILED:
+                st.error(f"Failed to process clip: '{clip_name}' ({job['error']})")
+            elif job["status"] == CANCELLED:
+                st.warning(f"Cancelled: '{clip_name}'")
+
+        # All finished clips as zips, written to disk and streamed like the
+        # clips; split into parts the static endpoint can serve
+        if len(finished_clips) > 1 and not batch_active:
+            bundle_tokens = st.session_state.get('clips_bundle_tokens') or []
+            if not bundle_tokens or not all(artifact_store.exists(token) for token in bundle_tokens):
+                if st.button("📦 Bundle All Clips (.zip)"):
+                    st.session_state.clips_bundle_tokens = artifact_store.bundle_zip(finished_clips)
+                    st.rerun()
+            else:
+                show_zip_download(bundle_tokens, file_name="clips.zip", label="📦 Download All Clips (.zip)")
+
+
+# --- Diagnostics ---
+# Open MoviePy readers (each one holds ffmpeg subprocesses and file handles)
+# in this server process and, as last reported, in the render workers
+with st.sidebar.expander("🔧 Media Readers"):
+    st.write({"app process": reader_pool.stats(), "render workers": st.session_state.get('worker_reader_stats', {})})
+
+# Render cache hits/misses for Generate since the server started, and its disk usage
+with st.sidebar.expander("💾 Render Cache"):
+    st.write(get_render_cache().stats())
+
+# Per-stage timings and peak RSS: this server process (all sessions) and the
+# background jobs of this session that have finished
+with st.sidebar.expander("⏱️ Profiling"):
+    session_job_ids = list(st.session_state.get('transcribe_jobs', {}).values())
+    session_job_ids += [job_id for _, job_id, _ in st.session_state.get('render_jobs', []) if job_id is not None]
+    session_job_ids += list(st.session_state.get('proxy_jobs', {}).values())
+    job_profiles = {}
+    for job_id in session_job_ids:
+        job = get_job_queue().get(job_id)
+        if job and job["status"] == DONE and job["result"].get("profile"):
+            job_profiles[f"{job['kind']} {job_id[:8]}"] = job["result"]["profile"]
+    profile_report = {"app process": profiler.summary(), "jobs": job_profiles}
+    st.json(profile_report, expanded=False)
+    st.download_button("Download profile (JSON)", json.dumps(profile_report, indent=2),
+                       file_name="profile.json", mime="application/json")
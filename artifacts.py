@@ -0,0 +1,151 @@
+"""On-disk store for generated files (rendered clips, edited images, zips).
+
+Artifacts live under ./static/artifacts, which Streamlit serves itself when
+static serving is enabled (see .streamlit/config.toml). Downloads are then
+plain links streamed from disk by the web server in small chunks, rather
+than whole files held in session memory by st.download_button. The static
+endpoint answers 404 for files over STATIC_FILE_MAX_BYTES, so zips are split
+into parts below that, and the app only links files that are servable().
+Names are random tokens, so one user's files can't be guessed by another.
+Files expire after a TTL, and the oldest go first when the store exceeds its
+size quota.
+"""
+import html
+import os
+import secrets
+import threading
+import time
+import zipfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ARTIFACT_ROOT = os.path.join(APP_DIR, "static", "artifacts")
+ARTIFACT_URL_PREFIX = "app/static/artifacts"
+ARTIFACT_TTL_SECONDS = 6 * 60 * 60 # 6 hours
+ARTIFACT_MAX_BYTES = 10 * 1024 ** 3 # 10 GiB
+PURGE_INTERVAL_SECONDS = 60 # purge_if_due() lists the store at most this often
+STATIC_FILE_MAX_BYTES = 200 * 1024 ** 2 # Streamlit's MAX_APP_STATIC_FILE_SIZE
+ZIP_MEMBER_OVERHEAD = 512 # Generous per-member zip headers (local, central directory, zip64), besides the name
+
+
+def link_or_copy(src_path, dst_path):
+    # Hard link when possible (no extra disk space), else a chunked copy
+    try:
+        os.link(src_path, dst_path)
+    except OSError: # Different filesystem
+        with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+            while chunk := src.read(1024 * 1024):
+                dst.write(chunk)
+
+
+def write_zip_parts(members, first_path, max_bytes=STATIC_FILE_MAX_BYTES):
+    # members: [(path, name_in_zip), ...]. Writes them as zips of at most
+    # `max_bytes` each (a member bigger than that gets a zip to itself):
+    # `first_path`, then the same name with -2, -3... Returns their paths.
+    # MP4s and images are already compressed, so ZIP_STORED; zipfile copies
+    # each member through in chunks.
+    parts, part_bytes = [[]], 0
+    for path, name in members:
+        member_bytes = os.path.getsize(path) + ZIP_MEMBER_OVERHEAD + 2 * len(name.encode("utf-8"))
+        if parts[-1] and part_bytes + member_bytes > max_bytes:
+            parts.append([])
+            part_bytes = 0
+        parts[-1].append((path, name))
+        part_bytes += member_bytes
+    base, ext = os.path.splitext(first_path)
+    paths = []
+    for i, part in enumerate(part for part in parts if part):
+        path = first_path if i == 0 else f"{base}-{i + 1}{ext}"
+        temp_path = f"{path}.tmp" # Renamed into place once complete
+        with zipfile.ZipFile(temp_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as bundle:
+            for member_path, name in part:
+                bundle.write(member_path, arcname=name)
+        os.replace(temp_path, path)
+        paths.append(path)
+    return paths
+
+
+class ArtifactStore:
+    def __init__(self, root=ARTIFACT_ROOT, ttl_seconds=ARTIFACT_TTL_SECONDS, max_bytes=ARTIFACT_MAX_BYTES):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._purge_lock = threading.Lock()
+        self._last_purge = float("-inf")
+
+    def new_token(self, ext):
+        return f"{secrets.token_urlsafe(16)}.{ext.lstrip('.')}"
+
+    def path(self, token):
+        return os.path.join(self.root, os.path.basename(token))
+
+    def url(self, token):
+        return f"{ARTIFACT_URL_PREFIX}/{token}"
+
+    def exists(self, token):
+        return bool(token) and os.path.exists(self.path(token))
+
+    def servable(self, token):
+        # Whether a download_link to it works (else it 404s)
+        try:
+            return bool(token) and os.path.getsize(self.path(token)) <= STATIC_FILE_MAX_BYTES
+        except FileNotFoundError:
+            return False
+
+    def add_file(self, src_path, ext, link=False):
+        # Move (or hard-link, to keep the source) an existing file into the store
+        token = self.new_token(ext)
+        if link:
+            link_or_copy(src_path, self.path(token))
+        else:
+            os.replace(src_path, self.path(token))
+        return token
+
+    def bundle_zip(self, entries):
+        # entries: [(token, name_in_zip), ...]. Returns the tokens of the zip
+        # parts, each small enough for the static endpoint (see write_zip_parts)
+        members = [(self.path(token), name) for token, name in entries if self.exists(token)]
+        return [os.path.basename(path) for path in write_zip_parts(members, self.path(self.new_token("zip")))]
+
+    def purge(self):
+        # Drop expired artifacts, then the oldest ones until under quota
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                self._remove(path)
+            elif not name.endswith(".tmp"):
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def purge_if_due(self):
+        # Cheap enough for every script run: only one caller per interval purges
+        with self._purge_lock:
+            now = time.monotonic()
+            if now - self._last_purge < PURGE_INTERVAL_SECONDS:
+                return
+            self._last_purge = now
+        self.purge()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def download_link(self, token, file_name, label):
+        # Markdown/HTML link that the browser downloads straight from the
+        # static endpoint; only for servable() tokens
+        return (f'<a href="{html.escape(self.url(token))}" download="{html.escape(file_name)}" '
+                f'target="_blank">{html.escape(label)}</a>')
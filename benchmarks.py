@@ -0,0 +1,407 @@
+"""Microbenchmarks for the clip generator's hot paths.
+
+Run from the repository root, e.g.:
+
+    python benchmarks.py segments --segments 10000 --clips 100
+    python benchmarks.py scoring --segments 10000 --clips 5
+    python benchmarks.py backends reference.mp4 --sizes tiny base
+    python benchmarks.py pipeline --duration 120 --json profile.json
+    python benchmarks.py pipeline --baseline profile.json --tolerance 0.25
+
+`pipeline` runs the whole clip generator headless: a synthetic video
+(ffmpeg testsrc + sine tone, generated locally), a stub transcript, and
+every render path plus PixelPy's draw/encode. It prints per-stage timings and
+peak RSS. Given --baseline, it exits non-zero when a stage got slower than
+the tolerance allows.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from scoring import ENVELOPE_HOP_SECONDS, score_windows
+from segments import SegmentIndex
+
+
+def synthetic_segments(count, seed=0):
+    # Back-to-back speech segments of 1-8 s, roughly like Whisper output
+    rng = random.Random(seed)
+    segments, t = [], 0.0
+    for i in range(count):
+        duration = rng.uniform(1.0, 8.0)
+        segments.append({"start": t, "end": t + duration, "text": f" segment {i}"})
+        t += duration + rng.uniform(0.0, 0.5)
+    return segments
+
+
+def synthetic_clips(segments, count, seed=1):
+    rng = random.Random(seed)
+    total = segments[-1]["end"]
+    clips = []
+    for _ in range(count):
+        start = rng.uniform(0.0, total - 60.0)
+        clips.append((start, start + rng.uniform(10.0, 60.0)))
+    return clips
+
+
+def linear_scan_query(all_segments, clip_start, clip_end):
+    # The old per-clip lookup: sort the whole transcript, then scan all of it
+    all_segments.sort(key=lambda s: s["start"])
+    events = []
+    for segment in all_segments:
+        if max(clip_start, segment["start"]) < min(clip_end, segment["end"]):
+            relative_start = max(clip_start, segment["start"]) - clip_start
+            relative_end = min(clip_end, segment["end"]) - clip_start
+            caption_text = str(segment["text"]).strip()
+            if not caption_text or relative_end <= relative_start:
+                continue
+            events.append((relative_start, relative_end, caption_text))
+    return events
+
+
+def bench_segments(args):
+    segments = synthetic_segments(args.segments)
+    clips = synthetic_clips(segments, args.clips)
+
+    t0 = time.perf_counter()
+    baseline = [linear_scan_query(segments, start, end) for start, end in clips]
+    linear_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    index = SegmentIndex(segments)
+    build_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    indexed = [index.query(start, end) for start, end in clips]
+    query_seconds = time.perf_counter() - t0
+
+    assert indexed == baseline, "SegmentIndex results differ from the linear scan"
+    print(f"{args.segments} segments x {args.clips} clips")
+    print(f"  linear scan:   {linear_seconds * 1000:9.2f} ms")
+    print(f"  index build:   {build_seconds * 1000:9.2f} ms (once per transcript)")
+    print(f"  index queries: {query_seconds * 1000:9.2f} ms")
+    print(f"  speedup:       {linear_seconds / query_seconds:9.1f}x (queries), "
+          f"{linear_seconds / (build_seconds + query_seconds):.1f}x (incl. build)")
+
+
+def bench_scoring(args):
+    segments = synthetic_segments(args.segments)
+    rng = np.random.default_rng(0)
+    envelope = rng.random(int(segments[-1]["end"] / ENVELOPE_HOP_SECONDS), dtype=np.float32) * 0.1
+    keywords = [f"{i}" for i in range(0, args.segments, 97)] # Sparse hits on the segment numbers
+
+    timings = []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        windows = score_windows(segments, args.min_duration, args.max_duration, args.clips,
+                                envelope=envelope, keywords=keywords)
+        timings.append(time.perf_counter() - t0)
+
+    for a, b in zip(windows, windows[1:]):
+        assert a["score"] >= b["score"], "Windows are not sorted by score"
+    spans = sorted((w["start"], w["end"]) for w in windows)
+    assert all(a[1] <= b[0] for a, b in zip(spans, spans[1:])), "Selected windows overlap"
+    print(f"{args.segments} segments ({segments[-1]['end'] / 3600:.1f} h), "
+          f"{args.min_duration:g}-{args.max_duration:g} s windows, top {args.clips}")
+    print(f"  best of {args.repeat}: {min(timings) * 1000:9.2f} ms")
+    for w in windows:
+        print(f"  {w['start']:9.1f}-{w['end']:9.1f} s  score {w['score']:6.2f}")
+
+
+# --- Whole-pipeline benchmark ---
+PIPELINE_NOISE_SECONDS = 0.05 # Slowdowns smaller than this are never reported as regressions
+
+# Render scenarios run on the best-scoring clip: (aspect ratio, reframe mode, captions)
+PIPELINE_RENDERS = {
+    "original_fast_cut": ("original", "auto", False),
+    "original_captions": ("original", "auto", True),
+    "vertical_pad": ("9:16", "auto", True),
+    "square_smart_crop": ("1:1", "smart", True),
+}
+
+
+def synthetic_video(path, duration, size, fps=25):
+    # testsrc pattern + 440 Hz tone as H.264/AAC; same args, same file
+    from media import run_ffmpeg
+
+    run_ffmpeg(["-f", "lavfi", "-i", f"testsrc=size={size}:rate={fps}:duration={duration}",
+                "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+                "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", path])
+    return path
+
+
+def stub_transcript(duration, seed=0):
+    # Like synthetic_segments, but with words in the text and cut to `duration`
+    rng = random.Random(seed)
+    segments, t = [], 0.0
+    while True:
+        segment_duration = rng.uniform(1.0, 8.0)
+        if t + segment_duration > duration:
+            return segments
+        word_count = int(segment_duration * rng.uniform(1.5, 3.5))
+        text = " ".join(f"word{rng.randrange(500)}" for _ in range(word_count))
+        segments.append({"start": t, "end": t + segment_duration, "text": f" {text}"})
+        t += segment_duration + rng.uniform(0.0, 0.5)
+
+
+def pipeline_environment():
+    from media import ffmpeg_binary
+
+    proc = subprocess.run([ffmpeg_binary(), "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": proc.stdout.decode("utf-8", "replace").split("\n")[0],
+    }
+
+
+def compare_profiles(baseline, report, tolerance):
+    # Stages (and overall peak RSS) that got worse by more than `tolerance`
+    regressions = []
+    for name, entry in report["stages"].items():
+        old = baseline["stages"].get(name)
+        if old is None:
+            continue
+        new_seconds, old_seconds = entry["mean_seconds"], old["mean_seconds"]
+        if new_seconds > old_seconds * (1 + tolerance) and new_seconds - old_seconds > PIPELINE_NOISE_SECONDS:
+            regressions.append(f"{name}: {old_seconds:.3f}s -> {new_seconds:.3f}s")
+    if report["peak_rss_mb"] > baseline.get("peak_rss_mb", float("inf")) * (1 + tolerance):
+        regressions.append(f"peak RSS: {baseline['peak_rss_mb']:.0f} MB -> {report['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def wait_for_jobs(queue, job_ids, poll_seconds=0.1):
+    from jobs import ACTIVE_STATUSES
+
+    while True:
+        jobs = [queue.get(job_id) for job_id in job_ids]
+        if all(job["status"] not in ACTIVE_STATUSES for job in jobs):
+            return jobs
+        time.sleep(poll_seconds)
+
+
+def bench_pipeline(args):
+    from PIL import Image
+
+    from clip_render import add_captions_and_process_clip
+    from jobs import DONE, MAX_CONCURRENT_JOBS, JobQueue, start_workers
+    from media import WHISPER_SAMPLE_RATE, probe, read_audio_pcm
+    from media_readers import reader_pool
+    from profiling import peak_rss_mb, profiler, stage
+    from render_cache import PROXY_ENCODER
+    from scoring import rms_envelope
+    from text_render import PNG_COMPRESS_LEVEL, draw_text, text_layer, text_masks
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="clip-generator-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    video_path = os.path.join(workdir, f"testsrc_{args.size}_{args.duration:g}s.mp4")
+    if not os.path.exists(video_path): # Generated once per workdir, not timed
+        synthetic_video(video_path, args.duration, args.size)
+    segments = stub_transcript(args.duration)
+    encoder = {"preset": args.preset, "threads": args.threads}
+    photo = Image.new("RGBA", (5472, 3648), (40, 80, 120, 255)) # 20 MP
+
+    # A private job queue and its workers, started before timing like the app's
+    workers = args.workers or MAX_CONCURRENT_JOBS
+    queue = JobQueue(os.path.join(workdir, "jobs.sqlite3"), max_concurrent=workers)
+    worker_procs = start_workers(workers, queue.db_path, max_concurrent=workers)
+
+    profiler.reset()
+    with stage("probe"):
+        probe(video_path)
+    try:
+        for _ in range(args.repeat):
+            with stage("decode_audio"):
+                audio = read_audio_pcm(video_path)
+            with stage("loudness_envelope"):
+                envelope = rms_envelope(audio, WHISPER_SAMPLE_RATE)
+            with stage("find_engaging_clips"):
+                windows = score_windows(segments, args.clip_seconds, args.clip_seconds * 1.5, args.clips,
+                                        envelope=envelope)
+            if not windows:
+                raise SystemExit(f"No {args.clip_seconds:g}s clip fits a {args.duration:g}s video")
+            with stage("caption_lookup"):
+                index = SegmentIndex(segments)
+                clips = [(w["start"], w["end"], index.query(w["start"], w["end"])) for w in windows]
+
+            start, end, captions = clips[0]
+            for name, (aspect_ratio, reframe, with_captions) in PIPELINE_RENDERS.items():
+                with stage(f"render:{name}"):
+                    add_captions_and_process_clip(
+                        video_path, captions if with_captions else [], start, end, font_size=36,
+                        aspect_ratio=aspect_ratio, reframe=reframe, encoder=encoder,
+                        output_path=os.path.join(workdir, f"{name}.mp4"),
+                    )
+            with stage("render:proxy"):
+                add_captions_and_process_clip(video_path, captions, start, end, font_size=36, aspect_ratio="9:16",
+                                              encoder=PROXY_ENCODER, output_path=os.path.join(workdir, "proxy.mp4"))
+            # Every clip at once as background render jobs, the way the app runs them
+            with stage("render_jobs"):
+                job_ids = [
+                    queue.submit("render", {
+                        "video_path": video_path, "captions": clip_captions, "clip_start": clip_start,
+                        "clip_end": clip_end, "font_size": 36, "aspect_ratio": "9:16", "encoder": encoder,
+                        "output_path": os.path.join(workdir, f"job_{i}.mp4"),
+                    })
+                    for i, (clip_start, clip_end, clip_captions) in enumerate(clips)
+                ]
+                jobs = wait_for_jobs(queue, job_ids)
+            failed = [job["error"] for job in jobs if job["status"] != DONE]
+            if failed:
+                raise SystemExit(f"Render job failed: {failed[0]}")
+
+            text_masks.cache_clear() # Cold glyph cache on every repeat
+            text_layer.cache_clear()
+            with stage("pixelpy_draw"):
+                edited = draw_text(photo, "Hello, PixelPy!", (2736, 1824), 150, "#FFFFFF")
+            with stage("pixelpy_redraw"): # New colour and position, cached glyphs
+                edited = draw_text(photo, "Hello, PixelPy!", (1000, 800), 150, "#FFCC00")
+            with stage("pixelpy_encode"):
+                edited.save(os.path.join(workdir, "photo.png"), format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    finally:
+        for proc in worker_procs:
+            proc.terminate()
+            proc.wait()
+    reader_pool.close_all()
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("func", "json", "baseline")},
+        "environment": pipeline_environment(),
+        "stages": profiler.summary(),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "children_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+    print(f"{args.duration:g}s {args.size} synthetic video, {len(segments)} stub segments, "
+          f"{len(clips)} clip(s), {args.repeat} repeat(s) -- {workdir}")
+    print(f"{'stage':28} {'count':>5} {'mean s':>8} {'max s':>8} {'peak RSS MB':>12}")
+    for name, entry in report["stages"].items():
+        print(f"{name:28} {entry['count']:5} {entry['mean_seconds']:8.3f} {entry['max_seconds']:8.3f} "
+              f"{entry['peak_rss_mb']:12.0f}")
+    print(f"peak RSS: {report['peak_rss_mb']:.0f} MB (children: {report['children_peak_rss_mb']:.0f} MB)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_profiles(json.load(f), report, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+def _measure_backend(config, media_path, threads):
+    # Runs in a fresh process so peak RSS belongs to this backend alone
+    from media import WHISPER_SAMPLE_RATE, read_audio_pcm
+    from whisper_backends import load_backend
+
+    audio = read_audio_pcm(media_path)
+    audio_seconds = len(audio) / WHISPER_SAMPLE_RATE
+    t0 = time.perf_counter()
+    backend = load_backend(config, threads)
+    load_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    segments = backend.transcribe(audio)
+    transcribe_seconds = time.perf_counter() - t0
+    return {
+        **config,
+        "audio_seconds": audio_seconds,
+        "load_seconds": load_seconds,
+        "transcribe_seconds": transcribe_seconds,
+        "real_time_factor": transcribe_seconds / audio_seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # KiB on Linux
+        "segments": len(segments),
+    }
+
+
+def bench_backends(args):
+    from whisper_backends import BACKENDS, available_backends
+
+    configs = []
+    for name in args.backends or available_backends():
+        for size in args.sizes:
+            for compute_type in args.compute_types or BACKENDS[name].compute_types:
+                if compute_type in BACKENDS[name].compute_types:
+                    configs.append({"backend": name, "model_size": size, "compute_type": compute_type})
+    if not configs:
+        raise SystemExit("No transcription backend installed (pip install openai-whisper and/or faster-whisper)")
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'backend':16} {'size':9} {'compute':13} {'load s':>7} {'RTF':>7} {'peak RSS MB':>12}")
+    for config in configs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            try:
+                result = pool.submit(_measure_backend, config, args.media, args.threads).result()
+            except Exception as e:
+                print(f"{config['backend']:16} {config['model_size']:9} {config['compute_type']:13} failed: {e}")
+                continue
+        results.append(result)
+        print(f"{result['backend']:16} {result['model_size']:9} {result['compute_type']:13} "
+              f"{result['load_seconds']:7.2f} {result['real_time_factor']:7.3f} {result['peak_rss_mb']:12.0f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    segments_parser = subparsers.add_parser("segments", help="Caption lookup: linear scan vs SegmentIndex")
+    segments_parser.add_argument("--segments", type=int, default=10000)
+    segments_parser.add_argument("--clips", type=int, default=100)
+    segments_parser.set_defaults(func=bench_segments)
+
+    scoring_parser = subparsers.add_parser("scoring", help="Engaging-clip scorer on a synthetic transcript")
+    scoring_parser.add_argument("--segments", type=int, default=10000)
+    scoring_parser.add_argument("--clips", type=int, default=5)
+    scoring_parser.add_argument("--min-duration", type=float, default=10.0)
+    scoring_parser.add_argument("--max-duration", type=float, default=60.0)
+    scoring_parser.add_argument("--repeat", type=int, default=5)
+    scoring_parser.set_defaults(func=bench_scoring)
+
+    backends_parser = subparsers.add_parser("backends", help="Real-time factor and peak RSS per transcription backend")
+    backends_parser.add_argument("media", help="Reference audio/video clip")
+    backends_parser.add_argument("--backends", nargs="+", help="Default: every installed backend")
+    backends_parser.add_argument("--sizes", nargs="+", default=["tiny", "base"])
+    backends_parser.add_argument("--compute-types", nargs="+", help="Default: every type the backend supports")
+    backends_parser.add_argument("--threads", type=int, default=None, help="CPU threads per model")
+    backends_parser.add_argument("--json", help="Also write the results to this JSON file")
+    backends_parser.set_defaults(func=bench_backends)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="Per-stage timings of the whole pipeline on a synthetic video")
+    pipeline_parser.add_argument("--duration", type=float, default=60.0, help="Synthetic video length in seconds")
+    pipeline_parser.add_argument("--size", default="1280x720")
+    pipeline_parser.add_argument("--clips", type=int, default=3)
+    pipeline_parser.add_argument("--clip-seconds", type=float, default=10.0)
+    pipeline_parser.add_argument("--preset", default="ultrafast", help="x264 preset for the renders")
+    pipeline_parser.add_argument("--threads", type=int, default=1, help="ffmpeg threads per render")
+    pipeline_parser.add_argument("--workers", type=int, default=None, help="Render job workers (default: the app's job limit)")
+    pipeline_parser.add_argument("--repeat", type=int, default=1)
+    pipeline_parser.add_argument("--workdir", help="Keeps the synthetic video between runs (default: a new temp dir)")
+    pipeline_parser.add_argument("--json", help="Write the report to this JSON file")
+    pipeline_parser.add_argument("--baseline", help="Earlier --json report to compare against")
+    pipeline_parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown per stage")
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Caption track generation for the clip generator.
+
+Captions are written as an ASS subtitle file and burned in by ffmpeg's
+libass filter during the one encode pass, instead of one ImageMagick
+TextClip per segment alpha-blended by MoviePy on every frame.
+"""
+
+ASS_TEMPLATE = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {width}
+PlayResY: {height}
+WrapStyle: 0
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Caption,{font},{font_size},{colour},&H000000FF,&H00000000,&H00000000,0,0,0,0,100,100,0,0,1,{outline},0,8,{margin_x},{margin_x},{margin_v},1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+def ass_colour(color):
+    # "#RRGGBB" (st.color_picker) or a few names -> ASS "&HAABBGGRR"
+    named = {"white": "#FFFFFF", "black": "#000000", "yellow": "#FFFF00"}
+    color = named.get(str(color).lower(), color).lstrip("#")
+    if len(color) != 6:
+        color = "FFFFFF"
+    red, green, blue = color[0:2], color[2:4], color[4:6]
+    return f"&H00{blue}{green}{red}".upper()
+
+
+def ass_timestamp(seconds):
+    centiseconds = int(round(max(0.0, seconds) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+
+def ass_text(text):
+    # Braces start override blocks and backslashes start escapes in ASS
+    text = text.replace("\\", "/").replace("{", "(").replace("}", ")")
+    return text.replace("\r", "").replace("\n", "\\N")
+
+
+def write_ass(path, events, width, height, font_size=24, font_color="white", font="Arial"):
+    header = ASS_TEMPLATE.format(
+        width=width, height=height, font=font, font_size=font_size,
+        colour=ass_colour(font_color),
+        outline=1.5,
+        margin_x=int(width * 0.05), # Max 90% width, auto wrap
+        margin_v=int(height * 0.85), # Top of the caption near the bottom
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(header)
+        for start, end, text in events:
+            f.write(f"Dialogue: 0,{ass_timestamp(start)},{ass_timestamp(end)},Caption,,0,0,0,,{ass_text(text)}\n")
+    return path
+
+
+def ass_filter(path):
+    # Filter-graph escaping for the ass= filename argument
+    escaped = path.replace("\\", "\\\\").replace(":", "\\:").replace("'", "\\'")
+    return f"ass='{escaped}'"
@@ -0,0 +1,163 @@
+"""Clip rendering (captions + aspect ratio) for the clip generator.
+
+Lives outside app.py so render worker processes can import it without
+executing the Streamlit script. Nothing in here touches `st`: problems are
+raised as exceptions or returned as warnings for the UI to display.
+"""
+import random
+import string
+
+import proglog
+import os
+from contextlib import ExitStack
+from moviepy.tools import find_extension
+
+from captions import ass_filter, write_ass
+from media import ffmpeg_has_filter, smart_cut_clip, stream_copy_clip
+from media_readers import reader_pool
+from profiling import stage
+from reframe import reframe_filters, subject_track
+
+# x264 presets from fastest to smallest output
+ENCODER_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+
+DEFAULT_ENCODER = {
+    "codec": "libx264",
+    "audio_codec": "aac",
+    "preset": "medium",
+    "threads": 1, # ffmpeg threads per clip; parallelism comes from the render pool
+    "cut_mode": "smart", # Fast path for uncaptioned "original" clips: "smart", "keyframe" or "off"
+    "max_height": None, # Downscale the output to at most this height (proxy previews)
+    "crf": None, # x264 quality override; None keeps the encoder default
+}
+
+# How the fast path trims clips that need no captions and no reframing
+CUT_MODES = {
+    "smart": "Smart cut (re-encode boundary GOPs only)",
+    "keyframe": "Stream copy (snap start to keyframe)",
+    "off": "Off (always full re-encode)",
+}
+
+
+def random_filename(ext="mp4"):
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=10)) + f".{ext}"
+
+
+class ClipRenderError(Exception):
+    pass
+
+
+class FrameProgressLogger(proglog.ProgressBarLogger):
+    # Forwards MoviePy's frame counter as a 0..1 fraction to `callback`
+    def __init__(self, callback):
+        super().__init__()
+        self.on_fraction = callback
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar != "t" or attr != "index":
+            return
+        total = self.bars[bar].get("total")
+        if total:
+            self.on_fraction(min(1.0, (value + 1) / total))
+
+
+def add_captions_and_process_clip(
+    video_path, captions, clip_start, clip_end,
+    font_size=24, font_color="white",
+    aspect_ratio="original", output_path=None,
+    encoder=None, progress_callback=None, reframe="auto"
+):
+    # `captions` are the clip's (relative_start, relative_end, text) events,
+    # see SegmentIndex.query. `reframe` is one of reframe.REFRAME_MODES. Returns (output_path, warnings); raises
+    # ClipRenderError on failure
+    encoder = {**DEFAULT_ENCODER, **(encoder or {})}
+    warnings = []
+    if output_path is None:
+        output_path = random_filename(ext="mp4")
+
+    # 0. Fast path: nothing to draw and nothing to reframe, so skip decoding
+    if encoder["cut_mode"] != "off" and aspect_ratio == "original" and not captions:
+        try:
+            with stage("fast_cut"):
+                if encoder["cut_mode"] == "keyframe":
+                    stream_copy_clip(video_path, clip_start, clip_end, output_path)
+                else:
+                    smart_cut_clip(video_path, clip_start, clip_end, output_path,
+                                   preset=encoder["preset"], threads=encoder["threads"])
+            if progress_callback:
+                progress_callback(1.0)
+            return output_path, warnings
+        except Exception as e:
+            warnings.append(f"Fast cut failed, falling back to a full re-encode: {e}")
+
+    with ExitStack() as stack: # Releases the pooled reader however we leave
+        try:
+            # Shared, pooled reader for this upload: no new ffmpeg processes per clip
+            with stage("open_reader"):
+                full_video = stack.enter_context(reader_pool.open(video_path))
+                clip = full_video.subclip(clip_start, clip_end)
+        except Exception as e:
+            raise ClipRenderError(f"Error loading or sub-clipping video: {e}") from e
+
+        # 1. Handle Aspect Ratio
+        # Crop/scale/pad run in ffmpeg's filter graph while encoding; MoviePy
+        # only pipes the source frames through
+        current_width, current_height = clip.size
+        track = None
+        if reframe == "smart" and aspect_ratio != "original":
+            try:
+                with stage("subject_track"):
+                    track = subject_track(video_path, clip_start, clip_end)
+            except Exception as e:
+                warnings.append(f"Smart crop fell back to a centre crop: {e}")
+        video_filters, final_width, final_height = reframe_filters(
+            current_width, current_height, aspect_ratio, mode=reframe, track=track
+        )
+
+        # 2. Add Captions
+        # All of the clip's captions go into one ASS track that ffmpeg's libass burns
+        # in while encoding, so there is no per-segment ImageMagick call and no
+        # per-frame Python compositing
+        subtitle_path = None
+        if captions:
+            if ffmpeg_has_filter("ass"):
+                subtitle_path = write_ass(
+                    os.path.splitext(output_path)[0] + ".ass", captions, final_width, final_height,
+                    font_size=font_size, font_color=font_color
+                )
+                video_filters.append(ass_filter(subtitle_path))
+            else:
+                warnings.append("Captions skipped: this ffmpeg build has no libass ('ass' filter).")
+
+        # 3. Downscale last, so captions are laid out exactly as in the full-size export
+        if encoder["max_height"] and final_height > encoder["max_height"]:
+            video_filters.append(f"scale=-2:{encoder['max_height']}")
+
+        ffmpeg_params = ["-vf", ",".join(video_filters)] if video_filters else []
+        if encoder["crf"] is not None:
+            ffmpeg_params += ["-crf", str(encoder["crf"])]
+
+        logger = FrameProgressLogger(progress_callback) if progress_callback else None
+        # MoviePy writes the audio track to a temp file first, by default in
+        # the working directory; keep it next to the output so it's cleaned up
+        # below even when the encode fails or is cancelled
+        audio_path = f"{os.path.splitext(output_path)[0]}.audio.{find_extension(encoder['audio_codec'])}"
+
+        try:
+            # Decode + reframe/caption filters + encode all happen in this one pass
+            with stage("encode"):
+                clip.write_videofile(
+                    output_path, codec=encoder["codec"], audio_codec=encoder["audio_codec"], fps=clip.fps,
+                    preset=encoder["preset"], threads=encoder["threads"], ffmpeg_params=ffmpeg_params,
+                    temp_audiofile=audio_path, logger=logger
+                )
+            return output_path, warnings
+        except Exception as e:
+            raise ClipRenderError(
+                f"Error writing output video: {e}. This could be due to an issue with FFmpeg, "
+                "video codecs, or insufficient disk space."
+            ) from e
+        finally:
+            for temp_path in (subtitle_path, audio_path):
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
@@ -0,0 +1,107 @@
+"""Small on-disk LRU cache shared by the clip generator.
+
+Entries are plain files named after their key, so they survive Streamlit
+reruns, new sessions and process restarts. Recency is tracked through the
+file mtime, which is bumped on every hit.
+"""
+import hashlib
+import json
+import os
+import stat as stat_module
+import tempfile
+
+DEFAULT_CACHE_ROOT = os.environ.get(
+    "CLIP_GENERATOR_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "ai-clip-generator"),
+)
+
+
+def make_key(*parts):
+    # Stable key from arbitrary JSON-serialisable parts (dicts are sorted)
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskLRUCache:
+    # `pinned` is an optional callable returning paths that eviction must
+    # skip, e.g. the inputs of jobs that are still queued or running
+    def __init__(self, root, max_bytes, pinned=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.pinned = pinned
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, key, suffix=""):
+        return os.path.join(self.root, f"{key}{suffix}")
+
+    def get(self, key, suffix=""):
+        path = self.path_for(key, suffix)
+        try:
+            os.utime(path)  # Mark as most recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put_file(self, key, src_path, suffix=""):
+        # Move (not copy) a finished file into the cache atomically
+        path = self.path_for(key, suffix)
+        os.replace(src_path, path)
+        self.evict()
+        return path
+
+    def delete(self, key, suffix=""):
+        try:
+            os.remove(self.path_for(key, suffix))
+        except FileNotFoundError:
+            pass
+
+    def get_json(self, key):
+        path = self.get(key, ".json")
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # Corrupt or half-deleted entry: treat as a miss
+            return None
+
+    def put_json(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        return self.put_file(key, tmp_path, ".json")
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if not stat_module.S_ISREG(stat.st_mode): # e.g. a partial/ work dir
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        # Drop least recently used entries until the cache fits its budget
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        pinned = {os.path.abspath(path) for path in self.pinned()} if self.pinned else set()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if os.path.abspath(path) in pinned:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
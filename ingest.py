@@ -0,0 +1,59 @@
+"""Upload ingestion for the clip generator.
+
+The uploaded bytes are hashed, then streamed into the upload store, in
+fixed-size slices of a memoryview (no second in-memory copy of the video).
+The file is stored under its SHA-256, and the upload is already in memory,
+so the hash is checked first and an upload that was already seen is never
+written to disk again. Each session remembers what it ingested, so reruns
+do no hashing and no disk writes at all.
+"""
+import hashlib
+import os
+import tempfile
+
+INGEST_CHUNK_SIZE = 8 * 1024 * 1024 # 8 MiB
+
+
+def upload_key(uploaded_file):
+    # Stable per upload within a session (a re-upload gets a new file_id)
+    return getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+
+
+def ingest_upload(uploaded_file, store, chunk_size=INGEST_CHUNK_SIZE):
+    # Returns (video_hash, path) for the stored copy of `uploaded_file`
+    suffix = os.path.splitext(uploaded_file.name)[1].lower()
+    view = uploaded_file.getbuffer() # memoryview: slicing it copies nothing
+    try:
+        hasher = hashlib.sha256()
+        for offset in range(0, len(view), chunk_size):
+            hasher.update(view[offset:offset + chunk_size])
+        video_hash = hasher.hexdigest()
+        path = store.get(video_hash, suffix)
+        if path is not None: # Seen before (maybe by another session): keep the stored copy
+            return video_hash, path
+
+        fd, temp_path = tempfile.mkstemp(dir=store.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for offset in range(0, len(view), chunk_size):
+                    f.write(view[offset:offset + chunk_size])
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    finally:
+        view.release()
+    return video_hash, store.put_file(video_hash, temp_path, suffix)
+
+
+def ingest_for_session(uploaded_file, store, session_state):
+    # Memoised per session: a rerun only touches the stored file's LRU stamp
+    ingested = session_state.setdefault("ingested_uploads", {})
+    key = upload_key(uploaded_file)
+    if key in ingested:
+        video_hash, suffix = ingested[key]
+        path = store.get(video_hash, suffix)
+        if path is not None:
+            return video_hash, path
+    video_hash, path = ingest_upload(uploaded_file, store)
+    ingested[key] = (video_hash, os.path.splitext(path)[1])
+    return video_hash, path
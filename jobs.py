@@ -0,0 +1,434 @@
+"""Local background job queue for transcription, rendering, previews and PixelPy batches.
+
+Jobs live in a SQLite database shared by every Streamlit session (and every
+server process on the box). A fixed number of worker processes claim and run
+them, which is also the global concurrency limit: however many users click
+"Generate", at most MAX_CONCURRENT_JOBS heavy jobs run at once. The UI only
+submits jobs and polls their state, so widget interaction never blocks or
+restarts a running transcription or render. Jobs that run their own process
+pool (transcription) take as many slots as that pool has processes.
+
+Workers are started by the app, or run standalone with:
+
+    python jobs.py worker
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from disk_cache import DEFAULT_CACHE_ROOT
+from profiling import profiler, stage
+
+JOBS_DB_PATH = os.path.join(DEFAULT_CACHE_ROOT, "jobs.sqlite3")
+MAX_CONCURRENT_JOBS = int(os.environ.get("CLIP_GENERATOR_MAX_JOBS", max(1, (os.cpu_count() or 1) // 4)))
+# Model processes per transcription (see iter_transcribe), and so its job slots
+TRANSCRIBE_JOB_WEIGHT = max(1, MAX_CONCURRENT_JOBS // 2)
+WORKER_IDLE_SLEEP = 0.5 # seconds between polls when the queue is empty
+PROGRESS_MIN_INTERVAL = 0.5 # seconds between progress writes from one job
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    owner TEXT,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker_pid INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_weight(kind, max_concurrent=MAX_CONCURRENT_JOBS):
+    # Job slots a running job of this kind takes
+    return min(max_concurrent, TRANSCRIBE_JOB_WEIGHT) if kind == "transcribe" else 1
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    def __init__(self, db_path=JOBS_DB_PATH, max_concurrent=MAX_CONCURRENT_JOBS):
+        self.db_path = db_path
+        self.max_concurrent = max_concurrent
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connection(self):
+        # Autocommit mode; multi-statement updates use explicit BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    # --- UI side ---
+    def submit(self, kind, params, owner=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, params, owner, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), owner, QUEUED, now, now),
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self._connection() as conn:
+            return self._row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def cancel(self, job_id):
+        # Queued jobs are cancelled right away; running ones at their next progress report
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                         (CANCELLED, now, job_id, QUEUED))
+            conn.execute("UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = ?",
+                         (now, job_id, RUNNING))
+
+    def active_video_paths(self):
+        # Source videos of queued/running jobs, which must stay on disk
+        with self._connection() as conn:
+            rows = conn.execute("SELECT params FROM jobs WHERE status IN (?, ?)", ACTIVE_STATUSES).fetchall()
+        paths = set()
+        for row in rows:
+            params = json.loads(row["params"])
+            params = params.get("render", params) # Proxy jobs nest their render params
+            if params.get("video_path"):
+                paths.add(params["video_path"])
+        return paths
+
+    def queue_position(self, job_id):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < (SELECT created_at FROM jobs WHERE id = ?)",
+                (QUEUED, job_id),
+            ).fetchone()
+        return row[0]
+
+    # --- Worker side ---
+    def claim(self, worker_pid):
+        # Atomically take the oldest queued job, unless its weight would take
+        # the running jobs over the global limit. Strictly in order, so a
+        # heavy job is not starved by lighter ones slipping past it.
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._fail_orphans(conn)
+                running = sum(job_weight(kind, self.max_concurrent) for kind, in conn.execute(
+                    "SELECT kind FROM jobs WHERE status = ?", (RUNNING,)).fetchall())
+                row = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                                   (QUEUED,)).fetchone()
+                if row is not None and running + job_weight(row["kind"], self.max_concurrent) > self.max_concurrent:
+                    row = None
+                if row is not None:
+                    conn.execute("UPDATE jobs SET status = ?, worker_pid = ?, updated_at = ? WHERE id = ?",
+                                 (RUNNING, worker_pid, time.time(), row["id"]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self._row_to_job(row)
+
+    def _fail_orphans(self, conn):
+        # Running jobs whose worker died (OOM kill, restart) would block a slot forever
+        for row in conn.execute("SELECT id, worker_pid FROM jobs WHERE status = ?", (RUNNING,)).fetchall():
+            if row["worker_pid"] and not _pid_alive(row["worker_pid"]):
+                conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                             (FAILED, "Worker process died", time.time(), row["id"]))
+
+    def report_progress(self, job_id, progress, message=None):
+        # Returns True when the job has been asked to stop
+        with self._connection() as conn:
+            conn.execute("UPDATE jobs SET progress = ?, message = COALESCE(?, message), updated_at = ? WHERE id = ?",
+                         (progress, message, time.time(), job_id))
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def finish(self, job_id, status, result=None, error=None):
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END, "
+                "result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+            )
+
+
+class JobContext:
+    # Handed to job handlers: throttled progress reporting + cancellation checks
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+        self._last_report = 0.0
+
+    def progress(self, fraction, message=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < PROGRESS_MIN_INTERVAL:
+            return
+        self._last_report = now
+        if self.queue.report_progress(self.job_id, fraction, message):
+            raise JobCancelled()
+
+
+# --- Job handlers ---
+def handle_transcribe(params, ctx):
+    from media import WHISPER_SAMPLE_RATE, read_audio_pcm
+    from scoring import ENVELOPE_HOP_SECONDS, rms_envelope
+    from transcription import TranscriptionCache, iter_transcribe
+
+    cache = TranscriptionCache()
+    ctx.progress(0.0, "Decoding audio...", force=True)
+    with stage("decode_audio"):
+        audio = read_audio_pcm(params["video_path"])
+    total_seconds = len(audio) / WHISPER_SAMPLE_RATE
+    # Loudness envelope for the clip scorer, while the PCM is in memory anyway
+    with stage("loudness_envelope"):
+        cache.put_envelope(params["video_hash"], ENVELOPE_HOP_SECONDS,
+                           rms_envelope(audio, WHISPER_SAMPLE_RATE, ENVELOPE_HOP_SECONDS))
+    ctx.progress(0.0, "Loading transcription models...", force=True)
+    segments = []
+    # Never more model processes than the job slots this job was given
+    stream = iter_transcribe(audio, params["backend_config"], params["whisper_options"],
+                             workers=job_weight("transcribe", ctx.queue.max_concurrent))
+    try:
+        with stage("transcribe"): # Model loading + all chunks, in the worker pool
+            for chunk_segments, seconds_done in stream:
+                segments.extend(chunk_segments)
+                # The transcript so far, for the UI's live view
+                cache.put_partial(params["video_hash"], params["backend_config"], params["cache_options"], segments)
+                ctx.progress(min(1.0, seconds_done / total_seconds),
+                             f"Transcribed {seconds_done:.0f}s of {total_seconds:.0f}s")
+    finally:
+        stream.close() # Cancels chunks that have not started yet
+    # The transcript cache is the hand-off to the UI
+    cache.put(params["video_hash"], params["backend_config"], params["cache_options"], segments)
+    return {"segments": len(segments)}
+
+
+def handle_render(params, ctx):
+    from artifacts import link_or_copy
+    from clip_render import add_captions_and_process_clip
+    from media_readers import reader_pool
+    from render_cache import RENDER_CACHE_MAX_BYTES, RenderCache
+
+    def report(fraction):
+        ctx.progress(fraction, f"Rendering... {fraction:.0%}")
+
+    ctx.progress(0.0, "Rendering...", force=True)
+    cache_key = params.pop("cache_key", None)
+    if cache_key is None:
+        path, warnings = add_captions_and_process_clip(progress_callback=report, **params)
+    else:
+        # Render into the render cache, then link the result to the requested path
+        cached_path, warnings = RenderCache("renders", RENDER_CACHE_MAX_BYTES).render(
+            cache_key, params, progress_callback=report
+        )
+        path = params["output_path"]
+        link_or_copy(cached_path, path)
+    # Reader counts after the clip is released, so leaks show up in the UI
+    return {"path": path, "warnings": warnings, "reader_stats": reader_pool.stats()}
+
+
+def handle_proxy(params, ctx):
+    from render_cache import PROXY_CACHE_MAX_BYTES, RenderCache
+
+    def report(fraction):
+        ctx.progress(fraction, f"Rendering preview... {fraction:.0%}")
+
+    ctx.progress(0.0, "Rendering preview...", force=True)
+    # The proxy cache is the hand-off to the UI, like the transcript cache
+    path, warnings = RenderCache("proxies", PROXY_CACHE_MAX_BYTES).render(
+        params["key"], params["render"], progress_callback=report
+    )
+    return {"path": path, "warnings": warnings}
+
+
+def handle_source_preview(params, ctx):
+    from render_cache import PROXY_CACHE_MAX_BYTES, RenderCache
+
+    def report(fraction):
+        ctx.progress(fraction, f"Rendering preview... {fraction:.0%}")
+
+    ctx.progress(0.0, "Rendering preview...", force=True)
+    # One job slot's share of the cores; the proxy cache is the hand-off to the UI
+    threads = max(1, (os.cpu_count() or 1) // ctx.queue.max_concurrent)
+    with stage("source_preview"):
+        path = RenderCache("proxies", PROXY_CACHE_MAX_BYTES).render_source_preview(
+            params["key"], params["video_path"], threads, progress_callback=report
+        )
+    return {"path": path}
+
+
+def handle_pixelpy_batch(params, ctx):
+    import shutil
+
+    from artifacts import write_zip_parts
+    from pixelpy_batch import run_batch
+
+    # The app wrote the inputs to `batch_dir`, which is removed when the job
+    # ends however it ends; the outputs are zipped to `output_path`
+    batch_dir = params["batch_dir"]
+    names = {os.path.join(batch_dir, file_name): name for file_name, name in params["images"]}
+    # JSON turned the outline colour tuple into a list; text_layer caches on it
+    spec = {**params["spec"], "stroke_color": tuple(params["spec"]["stroke_color"])}
+    tasks = ((path, {**spec, "output": name}) for path, name in names.items())
+    # One job slot's share of the cores, like a render
+    workers = max(1, (os.cpu_count() or 1) // ctx.queue.max_concurrent)
+    written, failed, zip_parts = [], [], []
+    ctx.progress(0.0, "Applying text...", force=True)
+    try:
+        with stage("pixelpy_batch"):
+            results = run_batch(tasks, os.path.join(batch_dir, "out"), params["format"], params["quality"], workers)
+            try:
+                for done, (image_path, output_path, error) in enumerate(results, 1):
+                    if error:
+                        failed.append((names[image_path], error))
+                    else:
+                        written.append(output_path)
+                    ctx.progress(done / len(names), f"{done} of {len(names)} images")
+            finally:
+                results.close()
+        if written:
+            # Split into zips the static endpoint can serve
+            zip_parts = write_zip_parts(
+                [(path, f"pixelpy_{os.path.basename(path)}") for path in written], params["output_path"]
+            )
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+    return {"written": len(written), "failed": failed, "zip_parts": [os.path.basename(path) for path in zip_parts]}
+
+
+HANDLERS = {
+    "transcribe": handle_transcribe,
+    "render": handle_render,
+    "proxy": handle_proxy,
+    "source_preview": handle_source_preview,
+    "pixelpy_batch": handle_pixelpy_batch,
+}
+
+
+def _was_cancelled(error):
+    # Cancellation raised from a progress callback may arrive wrapped
+    while error is not None:
+        if isinstance(error, JobCancelled):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def run_job(queue, job):
+    ctx = JobContext(queue, job["id"])
+    profiler.reset() # Stages of this job only (peak RSS is still the worker's lifetime peak)
+    try:
+        result = HANDLERS[job["kind"]](job["params"], ctx)
+        result["profile"] = profiler.summary()
+    except Exception as e:
+        if _was_cancelled(e):
+            queue.finish(job["id"], CANCELLED, error="Cancelled by user")
+        else:
+            queue.finish(job["id"], FAILED, error=str(e))
+        return
+    queue.finish(job["id"], DONE, result=result)
+
+
+def run_worker(db_path=JOBS_DB_PATH, parent_pid=None, max_concurrent=MAX_CONCURRENT_JOBS):
+    queue = JobQueue(db_path, max_concurrent)
+    while True:
+        if parent_pid and not _pid_alive(parent_pid):
+            return # The app that started us is gone
+        job = queue.claim(os.getpid())
+        if job is None:
+            time.sleep(WORKER_IDLE_SLEEP)
+            continue
+        run_job(queue, job)
+
+
+def start_workers(count=MAX_CONCURRENT_JOBS, db_path=JOBS_DB_PATH, max_concurrent=MAX_CONCURRENT_JOBS):
+    # Separate interpreters (not multiprocessing daemons) so jobs can run
+    # their own process pools; they exit on their own when the app goes away
+    here = os.path.dirname(os.path.abspath(__file__))
+    return [
+        subprocess.Popen([sys.executable, os.path.join(here, "jobs.py"), "worker",
+                          "--db", db_path, "--parent-pid", str(os.getpid()),
+                          "--max-jobs", str(max_concurrent)], cwd=here)
+        for _ in range(count)
+    ]
+
+
+class WorkerProcesses:
+    # The app's worker processes. A worker that died (OOM kill, crash) is
+    # replaced the next time ensure_running() is called, so the queue never
+    # silently loses capacity.
+    def __init__(self, count=MAX_CONCURRENT_JOBS, db_path=JOBS_DB_PATH, max_concurrent=MAX_CONCURRENT_JOBS):
+        self.count = count
+        self.db_path = db_path
+        self.max_concurrent = max_concurrent
+        self._lock = threading.Lock()
+        self._procs = []
+        self.respawned = 0
+
+    def ensure_running(self):
+        with self._lock:
+            alive = [proc for proc in self._procs if proc.poll() is None]
+            missing = self.count - len(alive)
+            if missing > 0:
+                if self._procs:
+                    self.respawned += missing
+                alive += start_workers(missing, self.db_path, self.max_concurrent)
+            self._procs = alive
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clip generator background job worker")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="Run a worker that processes queued jobs")
+    worker_parser.add_argument("--db", default=JOBS_DB_PATH)
+    worker_parser.add_argument("--parent-pid", type=int, default=None)
+    worker_parser.add_argument("--max-jobs", type=int, default=MAX_CONCURRENT_JOBS, help="Global running job limit")
+    args = parser.parse_args()
+    run_worker(args.db, args.parent_pid, args.max_jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""Thin ffmpeg/ffprobe helpers used by the clip generator.
+
+Everything here shells out to the same ffmpeg binary MoviePy is configured
+with, so no extra system dependency is needed. ffprobe is used when it is on
+PATH and we fall back to parsing `ffmpeg -i` output otherwise.
+"""
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from bisect import bisect_left
+from functools import lru_cache
+
+import numpy as np
+from moviepy.config import get_setting
+
+# Whisper expects 16 kHz mono float32 in [-1, 1]
+WHISPER_SAMPLE_RATE = 16000
+PCM_READ_CHUNK_BYTES = 1024 * 1024
+
+# Codecs we can re-encode boundary GOPs for and splice back losslessly
+SMART_CUT_CODECS = {"h264"}
+# SPS profile_idc -> libx264 -profile:v
+H264_PROFILES = {66: "baseline", 77: "main", 100: "high", 110: "high10", 122: "high422", 244: "high444"}
+NOPTS_VALUE = -2 ** 63 # What framecrc prints for a missing timestamp
+
+
+class MediaError(Exception):
+    pass
+
+
+def ffmpeg_binary():
+    return get_setting("FFMPEG_BINARY")
+
+
+def ffprobe_binary():
+    return shutil.which("ffprobe")
+
+
+def run_ffmpeg(args):
+    cmd = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y"] + list(args)
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise MediaError(proc.stderr.decode("utf-8", "replace").strip() or f"ffmpeg exited with {proc.returncode}")
+    return proc
+
+
+@lru_cache(maxsize=None)
+def ffmpeg_has_filter(name):
+    proc = subprocess.run([ffmpeg_binary(), "-hide_banner", "-filters"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return re.search(rf"^\s*\S+\s+{re.escape(name)}\s", proc.stdout.decode("utf-8", "replace"), re.M) is not None
+
+
+def file_identity(path):
+    # Cache key that changes when the file is replaced (caches move finished
+    # files into place, so a new file is a new inode). Not the mtime: the
+    # upload cache bumps it on every hit to track recency.
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_dev, stat.st_ino, stat.st_size
+
+
+# --- Probing ---
+def probe(path):
+    return _probe(*file_identity(path))
+
+
+@lru_cache(maxsize=64)
+def _probe(path, device, inode, size):
+    if ffprobe_binary():
+        return _probe_ffprobe(path)
+    return _probe_ffmpeg(path)
+
+
+def _probe_ffprobe(path):
+    cmd = [ffprobe_binary(), "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise MediaError(proc.stderr.decode("utf-8", "replace").strip())
+    info = json.loads(proc.stdout)
+    video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), None)
+    audio = next((s for s in info.get("streams", []) if s.get("codec_type") == "audio"), None)
+    fps = None
+    if video and video.get("avg_frame_rate", "0/0") != "0/0":
+        num, den = video["avg_frame_rate"].split("/")
+        fps = float(num) / float(den)
+    return {
+        "duration": float(info.get("format", {}).get("duration", 0.0)),
+        "video_codec": video.get("codec_name") if video else None,
+        "size": (int(video["width"]), int(video["height"])) if video else None,
+        "fps": fps,
+        "pix_fmt": video.get("pix_fmt") if video else None,
+        "has_audio": audio is not None,
+    }
+
+
+def _probe_ffmpeg(path):
+    # `ffmpeg -i` with no output always "fails" but prints the stream info
+    proc = subprocess.run([ffmpeg_binary(), "-hide_banner", "-i", path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    text = proc.stderr.decode("utf-8", "replace")
+    duration_match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", text)
+    if not duration_match:
+        raise MediaError(f"Could not read media info for {path}")
+    hours, minutes, seconds = duration_match.groups()
+    video_match = re.search(r"Stream #\S+.*?: Video: (\w+).*?, (\d{2,5})x(\d{2,5})", text)
+    fps_match = re.search(r"Stream #\S+.*?: Video: .*?, (\d+(?:\.\d+)?) fps", text)
+    pix_fmt_match = re.search(r"Stream #\S+.*?: Video: [^,]+, (\w+)[(,]", text)
+    return {
+        "duration": int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        "video_codec": video_match.group(1) if video_match else None,
+        "size": (int(video_match.group(2)), int(video_match.group(3))) if video_match else None,
+        "fps": float(fps_match.group(1)) if fps_match else None,
+        "pix_fmt": pix_fmt_match.group(1) if pix_fmt_match else None,
+        "has_audio": re.search(r"Stream #\S+.*?: Audio:", text) is not None,
+    }
+
+
+def keyframe_times(path):
+    return _keyframe_times(*file_identity(path))
+
+
+@lru_cache(maxsize=16)
+def _keyframe_times(path, device, inode, size):
+    if ffprobe_binary():
+        # Packet flags only: no decoding at all
+        cmd = [ffprobe_binary(), "-v", "error", "-select_streams", "v:0",
+               "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise MediaError(proc.stderr.decode("utf-8", "replace").strip())
+        times = []
+        for line in proc.stdout.decode().splitlines():
+            pts_time, _, flags = line.partition(",")
+            if "K" in flags and pts_time not in ("", "N/A"):
+                times.append(float(pts_time))
+    else:
+        # Decode keyframes only and let showinfo print their timestamps
+        cmd = [ffmpeg_binary(), "-hide_banner", "-skip_frame", "nokey", "-i", path,
+               "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        text = proc.stderr.decode("utf-8", "replace")
+        times = [float(t) for t in re.findall(r"pts_time:\s*(-?\d+(?:\.\d+)?)", text)]
+    return tuple(sorted(times))
+
+
+def h264_sps(path):
+    return _h264_sps(*file_identity(path))
+
+
+@lru_cache(maxsize=16)
+def _h264_sps(path, device, inode, size):
+    # {"profile_idc": ..., "level_idc": ...} of the first SPS; trace_headers
+    # parses the bitstream without decoding, and needs no ffprobe
+    cmd = [ffmpeg_binary(), "-hide_banner", "-i", path, "-map", "0:v:0", "-c", "copy",
+           "-bsf:v", "trace_headers", "-frames:v", "1", "-f", "null", "-"]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    text = proc.stderr.decode("utf-8", "replace")
+    return {name: int(value) for name, value in re.findall(r"\s(profile_idc|level_idc)\s+\S+ = (\d+)", text)}
+
+
+def video_packets(path):
+    return _video_packets(*file_identity(path))
+
+
+def _read_framecrc(text):
+    # [(dts, pts, flags)] of stream 0 in seconds; framecrc only prints flags
+    # that aren't just "key"
+    tb_match = re.search(r"^#tb 0: (\d+)/(\d+)", text, re.M)
+    if not tb_match:
+        return []
+    time_base = int(tb_match.group(1)) / int(tb_match.group(2))
+    packets = []
+    for line in text.splitlines():
+        fields = [field.strip() for field in line.split(",")]
+        if fields[0] != "0":
+            continue
+        dts, pts = int(fields[1]), int(fields[2])
+        if pts == NOPTS_VALUE or dts == NOPTS_VALUE:
+            raise MediaError("Video packets without timestamps")
+        flags = int(fields[-1][2:], 16) if fields[-1].startswith("F=") else 1
+        packets.append((dts * time_base, pts * time_base, flags))
+    return packets
+
+
+@lru_cache(maxsize=16)
+def _video_packets(path, device, inode, size):
+    # ((dts, pts, keyframe), ...) of the first video stream in decode order,
+    # in seconds. Packets are copied into framecrc, so nothing is decoded and
+    # no ffprobe is needed. For H.264 only IDR frames count as keyframes:
+    # containers flag open-GOP I-frames too, but the frames after those may
+    # still refer back across them.
+    h264 = probe(path)["video_codec"] == "h264"
+    with tempfile.TemporaryDirectory() as work_dir:
+        idr_path = os.path.join(work_dir, "idr.crc")
+        cmd = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y", "-i", path,
+               "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"]
+        if h264: # Second list with only the packets that hold an IDR slice (NAL type 5)
+            cmd += ["-map", "0:v:0", "-c", "copy", "-bsf:v", "filter_units=pass_types=5", "-f", "framecrc", idr_path]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise MediaError(proc.stderr.decode("utf-8", "replace").strip())
+        packets = _read_framecrc(proc.stdout.decode("utf-8", "replace"))
+        if h264:
+            with open(idr_path) as f:
+                idr = {(dts, pts) for dts, pts, _ in _read_framecrc(f.read())}
+            return tuple((dts, pts, (dts, pts) in idr) for dts, pts, _ in packets)
+    return tuple((dts, pts, bool(flags & 1)) for dts, pts, flags in packets)
+
+
+def split_points(packets):
+    # Decode-order indexes of the keyframes a stream can be split at: every
+    # packet before one is shown before it and every packet after it is
+    # shown at or after it. So the packets between two split points are
+    # exactly the frames shown between them (closed GOPs; an open GOP's
+    # leading B-frames rule its keyframe out).
+    later_min = [math.inf] * (len(packets) + 1)
+    for i in range(len(packets) - 1, -1, -1):
+        later_min[i] = min(packets[i][1], later_min[i + 1])
+    points, earlier_max = [], -math.inf
+    for i, (_, pts, keyframe) in enumerate(packets):
+        if keyframe and earlier_max < pts <= later_min[i + 1]:
+            points.append(i)
+        earlier_max = max(earlier_max, pts)
+    return points
+
+
+# --- Audio ---
+def read_audio_pcm(path, sample_rate=WHISPER_SAMPLE_RATE):
+    # Decode the audio track straight into memory as mono float32 PCM.
+    # ffmpeg writes raw s16le to a pipe which we read in fixed-size chunks
+    # into a buffer pre-sized from the probed duration: no temp file and no
+    # intermediate MP3 encode/decode.
+    try:
+        expected_samples = int(probe(path)["duration"] * sample_rate) + sample_rate
+    except MediaError:
+        expected_samples = 60 * sample_rate
+    buffer = bytearray(expected_samples * 2)
+    filled = 0
+
+    cmd = [ffmpeg_binary(), "-nostdin", "-hide_banner", "-loglevel", "error", "-i", path,
+           "-vn", "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "-"]
+    # stderr goes to a temp file: a pipe we only read after stdout EOF would
+    # fill up on a noisy input and block ffmpeg (and us) forever
+    with tempfile.TemporaryFile() as stderr_file, \
+            subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file) as proc:
+        while True:
+            if filled == len(buffer): # Duration was underestimated: grow by half
+                buffer.extend(bytes(max(len(buffer) // 2, PCM_READ_CHUNK_BYTES)))
+            with memoryview(buffer) as view:
+                read = proc.stdout.readinto(view[filled:filled + PCM_READ_CHUNK_BYTES])
+            if not read:
+                break
+            filled += read
+        if proc.wait() != 0:
+            stderr_file.seek(0)
+            errors = stderr_file.read().decode("utf-8", "replace").strip()
+            raise MediaError(errors or f"ffmpeg exited with {proc.returncode}")
+    if filled == 0:
+        raise MediaError(f"No audio track found in {path}")
+
+    samples = np.frombuffer(buffer, dtype=np.int16, count=filled // 2)
+    return samples.astype(np.float32) / 32768.0
+
+
+# --- Player copies ---
+def render_preview(video_path, output_path, height, fps, video_kbps, audio_kbps, threads=1, progress_callback=None):
+    # Small H.264/AAC copy of the whole video for the in-app player, in one
+    # ffmpeg pass. The bitrate is capped, so the size is bounded by the
+    # duration. `progress_callback(fraction)` follows ffmpeg's -progress
+    # reports; an exception from it stops ffmpeg and propagates.
+    duration = probe(video_path)["duration"]
+    cmd = [ffmpeg_binary(), "-nostdin", "-hide_banner", "-loglevel", "error", "-y", "-i", video_path,
+           "-map", "0:v:0", "-map", "0:a:0?", "-vf", f"fps={fps},scale=-2:'min({height},ih)'",
+           "-c:v", "libx264", "-preset", "veryfast", "-crf", "30", "-maxrate", f"{video_kbps}k",
+           "-bufsize", f"{2 * video_kbps}k", "-pix_fmt", "yuv420p", "-threads", str(threads),
+           "-c:a", "aac", "-b:a", f"{audio_kbps}k", "-ac", "1",
+           "-movflags", "+faststart", "-progress", "pipe:1", "-nostats", output_path]
+    # stderr goes to a temp file for the same reason as in read_audio_pcm
+    with tempfile.TemporaryFile() as stderr_file, \
+            subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file) as proc:
+        try:
+            for line in proc.stdout:
+                key, _, value = line.decode("utf-8", "replace").strip().partition("=")
+                if key == "out_time_us" and value.isdigit() and progress_callback and duration > 0:
+                    progress_callback(min(1.0, int(value) / 1e6 / duration))
+        except BaseException:
+            proc.kill()
+            raise
+        if proc.wait() != 0:
+            stderr_file.seek(0)
+            errors = stderr_file.read().decode("utf-8", "replace").strip()
+            raise MediaError(errors or f"ffmpeg exited with {proc.returncode}")
+    return output_path
+
+
+# --- Stream-copy cutting ---
+def stream_copy_clip(video_path, clip_start, clip_end, output_path):
+    # Snap the start back to the previous keyframe and copy packets as-is.
+    # Starts up to one GOP early, but runs at disk speed with zero generation loss.
+    keyframes = keyframe_times(video_path)
+    snapped = max((k for k in keyframes if k <= clip_start + 1e-3), default=0.0)
+    run_ffmpeg([
+        "-ss", f"{snapped:.6f}", "-i", video_path, "-t", f"{clip_end - snapped:.6f}",
+        "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy",
+        "-avoid_negative_ts", "make_zero", "-movflags", "+faststart", output_path,
+    ])
+    return output_path
+
+
+def matching_x264_args(video_path):
+    # libx264 settings that reproduce the source stream's profile, level and
+    # pixel format, or None when they can't be read or x264 can't produce them.
+    # Spliced GOPs must share them: players configure the decoder once, from
+    # the first SPS.
+    pix_fmt = probe(video_path).get("pix_fmt")
+    sps = h264_sps(video_path)
+    profile = H264_PROFILES.get(sps.get("profile_idc"))
+    level = sps.get("level_idc")
+    if profile is None or not level or not pix_fmt:
+        return None
+    # x264 signals the lowest profile the tools it used allow, so fast presets
+    # (no CABAC, no 8x8 transform) would otherwise come out as Baseline/Main
+    tools = ["-coder", "cavlc"] if profile == "baseline" else ["-coder", "cabac"]
+    if profile.startswith("high"):
+        tools += ["-8x8dct", "1"]
+    return ["-profile:v", profile, "-level", f"{level // 10}.{level % 10}", "-pix_fmt", pix_fmt] + tools
+
+
+def smart_cut_clip(video_path, clip_start, clip_end, output_path, preset="medium", threads=1):
+    # Frame-accurate cut of the source frames shown in [clip_start, clip_end)
+    # that only re-encodes the partial GOPs at each end. With a and b the
+    # first and last split points (see split_points) inside the clip:
+    #   frames before a -> re-encoded
+    #   packets from a up to b, in decode order -> stream copy
+    #   frames from b on -> re-encoded
+    # Parts end on exact frames (a frame count, or packet timestamps for the
+    # copy), never on a duration, so no frame is dropped or shown twice at a splice.
+    # Audio is cheap, so it is re-encoded once over the whole range to stay in sync.
+    # Raises MediaError when the source can't be matched; the caller then
+    # does a full re-encode (a keyframe stream copy would start early).
+    info = probe(video_path)
+    stream_args = matching_x264_args(video_path) if info["video_codec"] in SMART_CUT_CODECS else None
+    if stream_args is None:
+        raise MediaError(f"Smart cut needs an H.264 source with a readable SPS (got {info['video_codec']})")
+
+    packets = video_packets(video_path)
+    times = sorted(pts for _, pts, _ in packets) # Display order
+    first, end = bisect_left(times, clip_start - 1e-6), bisect_left(times, clip_end - 1e-6)
+    if first >= end:
+        raise MediaError(f"No video frames between {clip_start:.3f}s and {clip_end:.3f}s")
+    # Split points inside the clip, as (display index, decode index)
+    inner = [(bisect_left(times, packets[i][1]), i) for i in split_points(packets)]
+    inner = [point for point in inner if first <= point[0] <= end]
+    # (first frame's display index, frame count, copy?)
+    delay = 0.0
+    if len(inner) < 2:
+        parts = [(first, end - first, False)] # No whole GOP inside the range: just encode it
+    else:
+        (a, a_packet), (b, b_packet) = inner[0], inner[-1]
+        parts = [(first, a - first, False), (a, b - a, True), (b, end - b, False)]
+        # The copied packets decode their first frame ahead of its display
+        # time when they have B-frames. The re-encoded parts get the same DTS
+        # offset, else the splices repeat or go back in DTS.
+        delay = packets[a_packet][1] - packets[a_packet][0]
+    parts = [part for part in parts if part[1] > 0]
+
+    # No B-frames in the re-encoded GOPs so their timestamps butt up cleanly
+    # against the copied ones; a shared timescale lets the concat demuxer splice them
+    encode_args = ["-c:v", "libx264", "-preset", preset, "-bf", "0", "-threads", str(threads)] + stream_args
+    if delay > 0:
+        encode_args += ["-bsf:v", f"setts=dts=DTS-round({delay:.6f}/TB)"]
+
+    def between(earlier, later):
+        # Halfway between two timestamps, so float rounding can't pick the wrong frame
+        return (earlier + later) / 2
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        list_path = os.path.join(work_dir, "parts.txt")
+        with open(list_path, "w") as f:
+            for i, (index, count, copy) in enumerate(parts):
+                part_path = os.path.join(work_dir, f"part{i}.mp4")
+                seek = between(times[index - 1], times[index]) if index else 0.0
+                if copy:
+                    # ffmpeg seeks B-frame streams a little early and copies
+                    # from the keyframe before, so the copied packets are
+                    # picked by timestamp instead (relative to the seek
+                    # point): shown from a on, and decoded before b
+                    decoded_until = between(packets[b_packet - 1][0], packets[b_packet][0]) - seek
+                    select = ["-t", f"{decoded_until + 1:.6f}", "-c:v", "copy", "-bsf:v",
+                              f"noise=drop=lt(pts\\,0)+gte(dts*tb\\,{decoded_until:.6f})"]
+                else:
+                    select = ["-frames:v", str(count), "-fps_mode", "passthrough"] + encode_args
+                run_ffmpeg(["-ss", f"{seek:.6f}", "-i", video_path, "-map", "0:v:0", "-an"] + select +
+                           ["-video_track_timescale", "90000", part_path])
+                f.write(f"file '{part_path}'\n")
+                if i < len(parts) - 1: # Exact length, so the next part starts on the frame after
+                    f.write(f"duration {times[index + count] - times[index]:.6f}\n")
+
+        # Audio covers the last frame's display time too, else -shortest drops it
+        audio_end = times[end] if end < len(times) else clip_end
+        audio_args = ["-map", "1:a:0?", "-c:a", "aac"] if info["has_audio"] else []
+        run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path,
+                    "-ss", f"{times[first]:.6f}", "-t", f"{audio_end - times[first]:.6f}", "-i", video_path,
+                    "-map", "0:v:0", "-c:v", "copy"] + audio_args +
+                   ["-shortest", "-movflags", "+faststart", output_path])
+        return output_path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,73 @@
+"""Pooled MoviePy readers, one per upload per process.
+
+Every VideoFileClip starts ffmpeg reader subprocesses (video and audio) that
+only go away when the clip is closed. The pool hands out one shared clip per
+file, counts who is using it, and closes idle readers deterministically
+(least recently used first, and all of them at exit), so a long-lived worker
+never accumulates ffmpeg processes or file descriptors.
+"""
+import atexit
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from moviepy.editor import VideoFileClip
+
+from media import file_identity
+
+MAX_IDLE_READERS = 2
+
+
+class ReaderPool:
+    def __init__(self, max_idle=MAX_IDLE_READERS):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._readers = OrderedDict() # file identity -> [clip, users]
+        self.counters = {"opened": 0, "reused": 0, "closed": 0}
+
+    @contextmanager
+    def open(self, path):
+        key = file_identity(path)
+        with self._lock:
+            entry = self._readers.get(key)
+            if entry is None:
+                entry = [VideoFileClip(path), 0]
+                self._readers[key] = entry
+                self.counters["opened"] += 1
+            else:
+                self.counters["reused"] += 1
+            entry[1] += 1
+            self._readers.move_to_end(key)
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                self._trim()
+
+    def _trim(self):
+        idle = [key for key, (_, users) in self._readers.items() if users == 0]
+        for key in idle[:max(0, len(idle) - self.max_idle)]:
+            self._close_entry(key)
+
+    def _close_entry(self, key):
+        clip, _ = self._readers.pop(key)
+        clip.close()
+        self.counters["closed"] += 1
+
+    def close_all(self):
+        with self._lock:
+            for key in list(self._readers):
+                self._close_entry(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open_readers": len(self._readers),
+                "in_use": sum(1 for _, users in self._readers.values() if users),
+                **self.counters,
+            }
+
+
+reader_pool = ReaderPool()
+atexit.register(reader_pool.close_all)
@@ -0,0 +1,165 @@
+"""Batch text overlays for PixelPy, usable headless.
+
+Applies one text spec to every image matched by directories/globs, or per
+image text from a CSV (columns: image, text, and optionally x, y,
+font_size, color, output). Images are streamed to a process pool with a bounded
+number in flight, so a directory of thousands of files is never listed or
+loaded up front. Outputs are named after the image (or the CSV's output
+column); names already used in the run get a numeric suffix. Examples:
+
+    python pixelpy_batch.py "photos/*.jpg" --text "SALE" --y 90 --out thumbs --format webp --quality 85
+    python pixelpy_batch.py photos/ --csv captions.csv --out thumbs --format jpeg
+"""
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from PIL import Image
+
+from text_render import OUTLINE_COLOR, OUTLINE_WIDTH, PNG_COMPRESS_LEVEL, draw_text
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+OUTPUT_FORMATS = {"png": "PNG", "webp": "WEBP", "jpeg": "JPEG"}
+
+DEFAULT_SPEC = {
+    "text": "Hello, PixelPy!",
+    "x": 50.0, # Position of the text centre, in % of the image size
+    "y": 50.0,
+    "font_size": 50,
+    "color": "#FFFFFF",
+    "stroke_color": OUTLINE_COLOR,
+    "stroke_width": OUTLINE_WIDTH,
+}
+
+
+def iter_image_paths(inputs):
+    # Directories (not recursive) and glob patterns, lazily
+    for item in inputs:
+        if os.path.isdir(item):
+            with os.scandir(item) as entries:
+                for entry in entries:
+                    if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                        yield entry.path
+        else:
+            for path in glob.iglob(item):
+                if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+                    yield path
+
+
+def iter_csv_specs(csv_path, base_spec, image_dir=None):
+    # (image path, spec) per CSV row; relative image paths are resolved
+    # against `image_dir`, else the CSV's own directory
+    image_dir = image_dir or os.path.dirname(os.path.abspath(csv_path))
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            spec = dict(base_spec)
+            for field, cast in (("text", str), ("x", float), ("y", float), ("font_size", int), ("color", str),
+                                ("output", str)):
+                if row.get(field):
+                    spec[field] = cast(row[field])
+            yield os.path.join(image_dir, row["image"]), spec
+
+
+def output_path_for(image_path, out_dir, fmt, name=None, taken=None):
+    # `name` (e.g. the CSV's optional "output" column) replaces the image's own
+    # name. Paths in `taken` (the ones this run already uses) get a numeric
+    # suffix instead, so a/x.jpg, b/x.jpg and a/x.png don't all become x.<fmt>.
+    stem = os.path.splitext(name or os.path.basename(image_path))[0]
+    path = os.path.join(out_dir, f"{stem}.{fmt}")
+    suffix = 2
+    while taken is not None and path in taken:
+        path = os.path.join(out_dir, f"{stem}_{suffix}.{fmt}")
+        suffix += 1
+    if taken is not None:
+        taken.add(path)
+    return path
+
+
+def render_image(image_path, output_path, spec, fmt="png", quality=90):
+    # Runs in a pool worker. Returns (image_path, output_path, error)
+    try:
+        with Image.open(image_path) as source:
+            image = source.convert("RGBA")
+        xy = (image.width * spec["x"] / 100, image.height * spec["y"] / 100)
+        result = draw_text(image, spec["text"], xy, spec["font_size"], spec["color"],
+                           spec["stroke_color"], spec["stroke_width"])
+        if fmt == "jpeg":
+            result = result.convert("RGB") # No alpha channel in JPEG
+        options = {"compress_level": PNG_COMPRESS_LEVEL} if fmt == "png" else {"quality": quality}
+        result.save(output_path, OUTPUT_FORMATS[fmt], **options)
+        return image_path, output_path, None
+    except Exception as e:
+        return image_path, output_path, str(e)
+
+
+def default_worker_count():
+    return max(1, os.cpu_count() or 1)
+
+
+def run_batch(tasks, out_dir, fmt="png", quality=90, workers=None, max_in_flight=None):
+    # `tasks` is an iterable of (image_path, spec); yields (image_path,
+    # output_path, error) as images finish, in completion order
+    workers = workers or default_worker_count()
+    max_in_flight = max_in_flight or workers * 4
+    os.makedirs(out_dir, exist_ok=True)
+    taken = set() # Output paths of this run: a later image never overwrites an earlier one
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        pending = set()
+        for image_path, spec in tasks:
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            output_path = output_path_for(image_path, out_dir, fmt, spec.get("output"), taken)
+            pending.add(pool.submit(render_image, image_path, output_path, spec, fmt, quality))
+        for future in pending:
+            yield future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="*", help="Image directories or glob patterns (with --csv: the image directory)")
+    parser.add_argument("--csv", help="Per-image text: columns image, text[, x, y, font_size, color, output]")
+    parser.add_argument("--text", default=DEFAULT_SPEC["text"])
+    parser.add_argument("--x", type=float, default=DEFAULT_SPEC["x"], help="Text centre, %% of the width")
+    parser.add_argument("--y", type=float, default=DEFAULT_SPEC["y"], help="Text centre, %% of the height")
+    parser.add_argument("--font-size", type=int, default=DEFAULT_SPEC["font_size"])
+    parser.add_argument("--color", default=DEFAULT_SPEC["color"])
+    parser.add_argument("--stroke-width", type=int, default=DEFAULT_SPEC["stroke_width"])
+    parser.add_argument("--out", required=True, help="Output directory")
+    parser.add_argument("--format", choices=list(OUTPUT_FORMATS), default="png")
+    parser.add_argument("--quality", type=int, default=90, help="WebP/JPEG quality (1-100)")
+    parser.add_argument("--workers", type=int, default=None, help="Default: one per CPU")
+    args = parser.parse_args(argv)
+
+    spec = {**DEFAULT_SPEC, "text": args.text, "x": args.x, "y": args.y, "font_size": args.font_size,
+            "color": args.color, "stroke_width": args.stroke_width}
+    if args.csv:
+        if len(args.inputs) > 1:
+            parser.error("with --csv, give at most one image directory")
+        tasks = iter_csv_specs(args.csv, spec, args.inputs[0] if args.inputs else None)
+    elif args.inputs:
+        tasks = ((path, spec) for path in iter_image_paths(args.inputs))
+    else:
+        parser.error("give image directories/globs or --csv")
+
+    done = failed = 0
+    for image_path, output_path, error in run_batch(tasks, args.out, args.format, args.quality, args.workers):
+        if error:
+            failed += 1
+            print(f"FAILED {image_path}: {error}", file=sys.stderr)
+        else:
+            done += 1
+            if done % 100 == 0:
+                print(f"{done} images written", file=sys.stderr)
+    print(f"{done} written to {args.out}, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Per-stage timing and peak memory for the clip generator and PixelPy.
+
+Code marks its stages with `with stage("encode"):`. Every process has its
+own profiler that aggregates per stage name:
+- call count, total/mean/max wall time
+- peak RSS of the process when the stage ended (ru_maxrss only grows, so
+  the stage where it jumps is the one that allocated)
+- peak RSS of finished child processes such as ffmpeg
+
+Job workers reset the profiler per job and return its summary with the job
+result, so the UI can show worker-side stages next to the app's own.
+"""
+import json
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss / 1024 # KiB on Linux
+
+
+class StageProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        rss_before = peak_rss_mb()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            rss = peak_rss_mb()
+            with self._lock:
+                entry = self._stages.setdefault(name, {
+                    "count": 0, "total_seconds": 0.0, "max_seconds": 0.0,
+                    "peak_rss_mb": 0.0, "rss_growth_mb": 0.0, "children_peak_rss_mb": 0.0,
+                })
+                entry["count"] += 1
+                entry["total_seconds"] += seconds
+                entry["max_seconds"] = max(entry["max_seconds"], seconds)
+                entry["peak_rss_mb"] = max(entry["peak_rss_mb"], rss)
+                entry["rss_growth_mb"] += rss - rss_before
+                entry["children_peak_rss_mb"] = max(entry["children_peak_rss_mb"], peak_rss_mb(resource.RUSAGE_CHILDREN))
+
+    def summary(self):
+        # {stage: {...}} in the order the stages first ran
+        with self._lock:
+            return {
+                name: {
+                    **{key: round(value, 4) if isinstance(value, float) else value for key, value in entry.items()},
+                    "mean_seconds": round(entry["total_seconds"] / entry["count"], 4),
+                }
+                for name, entry in self._stages.items()
+            }
+
+    def to_json(self, **extra):
+        return json.dumps({"stages": self.summary(), **extra}, indent=2)
+
+
+profiler = StageProfiler()
+stage = profiler.stage
@@ -0,0 +1,154 @@
+"""Aspect-ratio reframing as an ffmpeg filter chain.
+
+Cropping, scaling and padding run inside ffmpeg's filter graph on the
+encoder side (crop/scale/pad), not as per-frame MoviePy callbacks. Smart
+crop follows the subject: faces when OpenCV is installed, otherwise the
+centre of motion. The subject is found on a low-res grey copy of the clip
+(a few frames per second, decoded by ffmpeg into NumPy). The smoothed track
+becomes a time-dependent x/y expression for the crop filter.
+"""
+import importlib.util
+import subprocess
+
+import numpy as np
+
+from media import MediaError, ffmpeg_binary, probe
+
+# Target aspect ratios as (width, height) units
+ASPECT_RATIOS = {"9:16": (9, 16), "1:1": (1, 1), "16:9": (16, 9)}
+
+REFRAME_MODES = {
+    "auto": "Pad or crop around the centre",
+    "crop": "Always crop around the centre",
+    "smart": "Smart crop (follow faces / motion)",
+}
+
+TRACK_FPS = 2 # Subject samples per second
+TRACK_WIDTH = 320 # Analysis frame width; faces of a few % of the frame are still found
+TRACK_SMOOTH_SAMPLES = 5 # ~2.5 s moving average, so the crop pans instead of jittering
+MOTION_THRESHOLD = 12 # Grey-level change that counts as motion
+
+
+def _even(value):
+    return max(2, int(value) // 2 * 2)
+
+
+def available_detectors():
+    return ["face", "motion"] if importlib.util.find_spec("cv2") is not None else ["motion"]
+
+
+def read_grey_frames(video_path, clip_start, clip_end, fps=TRACK_FPS, width=TRACK_WIDTH):
+    # (n, h, w) uint8 frames of the clip at `fps`, scaled to `width`
+    src_width, src_height = probe(video_path)["size"]
+    height = _even(width * src_height / src_width)
+    cmd = [ffmpeg_binary(), "-hide_banner", "-loglevel", "error",
+           "-ss", f"{clip_start:.3f}", "-t", f"{clip_end - clip_start:.3f}", "-i", video_path,
+           "-an", "-vf", f"fps={fps},scale={width}:{height},format=gray", "-f", "rawvideo", "-"]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise MediaError(proc.stderr.decode("utf-8", "replace").strip())
+    frames = np.frombuffer(proc.stdout, dtype=np.uint8)
+    return frames[:len(frames) // (width * height) * width * height].reshape(-1, height, width)
+
+
+def _face_centres(frames):
+    import cv2
+
+    detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    centres = []
+    for frame in frames:
+        faces = detector.detectMultiScale(frame, scaleFactor=1.2, minNeighbors=4)
+        if len(faces):
+            x, y, w, h = max(faces, key=lambda f: f[2] * f[3]) # Largest face
+            centres.append(((x + w / 2) / frame.shape[1], (y + h / 2) / frame.shape[0]))
+        else:
+            centres.append(None)
+    return centres
+
+
+def _motion_centres(frames):
+    # Centroid of the pixels that changed since the previous sample
+    height, width = frames.shape[1:]
+    xs, ys = np.arange(width), np.arange(height)
+    diffs = np.abs(np.diff(frames.astype(np.int16), axis=0)) > MOTION_THRESHOLD
+    centres = [None]
+    for moved in diffs:
+        total = moved.sum()
+        if total == 0:
+            centres.append(None)
+            continue
+        centres.append((moved.sum(axis=0) @ xs / total / width, moved.sum(axis=1) @ ys / total / height))
+    return centres
+
+
+def subject_track(video_path, clip_start, clip_end):
+    # [(t, cx, cy), ...] with t clip-relative and cx/cy as fractions of the frame
+    frames = read_grey_frames(video_path, clip_start, clip_end)
+    if len(frames) == 0:
+        return []
+    centres = _face_centres(frames) if "face" in available_detectors() else [None] * len(frames)
+    if not any(centres): # No faces anywhere: follow motion instead
+        centres = _motion_centres(frames)
+    # Fill gaps with the last known centre (the first one before it is found)
+    filled, last = [], next((c for c in centres if c), (0.5, 0.5))
+    for centre in centres:
+        last = centre or last
+        filled.append(last)
+    track = np.array(filled)
+    if len(track) >= TRACK_SMOOTH_SAMPLES:
+        kernel = np.ones(TRACK_SMOOTH_SAMPLES) / TRACK_SMOOTH_SAMPLES
+        padded = np.pad(track, ((TRACK_SMOOTH_SAMPLES // 2, TRACK_SMOOTH_SAMPLES // 2), (0, 0)), mode="edge")
+        track = np.stack([np.convolve(padded[:, i], kernel, mode="valid") for i in range(2)], axis=1)
+    return [(i / TRACK_FPS, float(cx), float(cy)) for i, (cx, cy) in enumerate(track)]
+
+
+def _track_expression(times, values):
+    # Piecewise-linear f(t) as a flat sum of clamped ramps (no nesting, so
+    # long clips don't hit ffmpeg's expression depth limits)
+    terms = [f"{values[0]:.4f}"]
+    for i in range(1, len(times)):
+        step = values[i] - values[i - 1]
+        if abs(step) >= 1e-4:
+            terms.append(f"{step:+.4f}*clip((t-{times[i - 1]:.3f})/{times[i] - times[i - 1]:.3f},0,1)")
+    return "".join(terms)
+
+
+def reframe_filters(width, height, aspect_ratio, mode="auto", track=None):
+    # Returns (ffmpeg filters, output width, output height) that bring a
+    # width x height video to `aspect_ratio`. "auto" pads when the source is
+    # on the other side of square (landscape into 9:16, portrait into 16:9)
+    # and crops otherwise; "crop" and "smart" always crop.
+    if aspect_ratio not in ASPECT_RATIOS:
+        return [], width, height
+    units_w, units_h = ASPECT_RATIOS[aspect_ratio]
+    if width * units_h == height * units_w:
+        return [], width, height
+    too_wide = width * units_h > height * units_w
+    pad = mode == "auto" and ((units_w < units_h and too_wide) or (units_w > units_h and not too_wide))
+
+    if pad:
+        # Canvas keeps the source's long side; the whole frame is scaled into it
+        long_side = max(width, height)
+        if units_w < units_h:
+            out_h = _even(long_side)
+            out_w = _even(out_h * units_w / units_h)
+        else:
+            out_w = _even(long_side)
+            out_h = _even(out_w * units_h / units_w)
+        scale = min(out_w / width, out_h / height)
+        scaled_w, scaled_h = _even(width * scale), _even(height * scale)
+        return [f"scale={scaled_w}:{scaled_h}",
+                f"pad={out_w}:{out_h}:{(out_w - scaled_w) // 2}:{(out_h - scaled_h) // 2}:black"], out_w, out_h
+
+    if too_wide:
+        out_w, out_h = _even(height * units_w / units_h), _even(height)
+    else:
+        out_w, out_h = _even(width), _even(width * units_h / units_w)
+    x, y = "(iw-ow)/2", "(ih-oh)/2"
+    if mode == "smart" and track:
+        times = [t for t, _, _ in track]
+        if too_wide:
+            x = f"clip(({_track_expression(times, [cx for _, cx, _ in track])})*iw-ow/2,0,iw-ow)"
+        else:
+            y = f"clip(({_track_expression(times, [cy for _, _, cy in track])})*ih-oh/2,0,ih-oh)"
+    return [f"crop={out_w}:{out_h}:'{x}':'{y}'"], out_w, out_h
@@ -0,0 +1,90 @@
+"""Rendered clips cached on disk by their render parameters.
+
+The key covers the uploaded bytes (by hash) and every parameter that changes
+the output: range, captions, aspect ratio, caption style and encoder
+settings. Paths don't count. A render that was already done is one file
+lookup away, however many reruns or sessions ago it happened. Renders go to
+a partial/ subdirectory first, so an unfinished file is never served and is
+never evicted halfway through. The proxy cache also holds the player copy of
+each whole upload (see render_source_preview).
+"""
+import os
+import tempfile
+
+from clip_render import add_captions_and_process_clip
+from disk_cache import DEFAULT_CACHE_ROOT, DiskLRUCache, make_key
+from media import probe, render_preview
+
+RENDER_CACHE_MAX_BYTES = 10 * 1024 ** 3 # 10 GiB of full-quality clips
+PROXY_CACHE_MAX_BYTES = 2 * 1024 ** 3 # 2 GiB of low-res previews
+
+# Previews: same captions and reframing as the export, but 360p, ultrafast,
+# always re-encoded, and independent of the export's encoder settings
+PROXY_ENCODER = {"preset": "ultrafast", "threads": 1, "cut_mode": "off", "max_height": 360, "crf": 32}
+
+# Player copy of a whole upload. st.video reads the file on every rerun, so
+# long videos get a lower bitrate to stay within max_bytes (down to min_kbps)
+SOURCE_PREVIEW = {"height": 240, "fps": 15, "audio_kbps": 32, "min_kbps": 48, "max_kbps": 400,
+                  "max_bytes": 48 * 1024 ** 2}
+
+
+class RenderCache:
+    def __init__(self, name, max_bytes):
+        self.store = DiskLRUCache(os.path.join(DEFAULT_CACHE_ROOT, name), max_bytes)
+        self.partial_dir = os.path.join(self.store.root, "partial")
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.counters = {"hits": 0, "misses": 0} # Lookups through this instance
+
+    @staticmethod
+    def key(video_hash, render_params):
+        # `render_params` are add_captions_and_process_clip kwargs
+        params = {k: v for k, v in render_params.items() if k not in ("video_path", "output_path")}
+        return make_key("render", video_hash, params)
+
+    def get(self, key):
+        path = self.store.get(key, ".mp4")
+        self.counters["hits" if path is not None else "misses"] += 1
+        return path
+
+    def stats(self):
+        entries = self.store.entries()
+        return {
+            **self.counters,
+            "clips": len(entries),
+            "size_mb": round(sum(size for _, size, _ in entries) / 1024 ** 2, 1),
+            "budget_mb": round(self.store.max_bytes / 1024 ** 2),
+        }
+
+    def _render_into(self, key, render):
+        # Returns (cached_path, whatever `render(partial_path)` returned)
+        fd, partial_path = tempfile.mkstemp(dir=self.partial_dir, suffix=".mp4")
+        os.close(fd)
+        try:
+            result = render(partial_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        return self.store.put_file(key, partial_path, ".mp4"), result
+
+    def render(self, key, render_params, progress_callback=None):
+        # Returns (cached_path, warnings)
+        path, (_, warnings) = self._render_into(key, lambda partial_path: add_captions_and_process_clip(
+            **{**render_params, "output_path": partial_path}, progress_callback=progress_callback
+        ))
+        return path, warnings
+
+    @staticmethod
+    def source_preview_key(video_hash):
+        return make_key("source_preview", video_hash, SOURCE_PREVIEW)
+
+    def render_source_preview(self, key, video_path, threads=1, progress_callback=None):
+        # Returns the cached path of the upload's player copy
+        budget_kbps = SOURCE_PREVIEW["max_bytes"] * 8 / 1000 / max(1.0, probe(video_path)["duration"])
+        video_kbps = int(min(SOURCE_PREVIEW["max_kbps"],
+                             max(SOURCE_PREVIEW["min_kbps"], budget_kbps - SOURCE_PREVIEW["audio_kbps"])))
+        path, _ = self._render_into(key, lambda partial_path: render_preview(
+            video_path, partial_path, SOURCE_PREVIEW["height"], SOURCE_PREVIEW["fps"], video_kbps,
+            SOURCE_PREVIEW["audio_kbps"], threads, progress_callback
+        ))
+        return path
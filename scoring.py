@@ -0,0 +1,186 @@
+"""Engaging-clip scorer over the transcript timeline.
+
+Candidate windows are runs of consecutive segments whose span falls within
+[min_duration, max_duration]. Each segment starts CANDIDATE_LENGTHS of them,
+with target lengths spread over that range. Every feature of a window comes
+from prefix sums, so each one costs O(1):
+
+- words per second (dense speech)
+- pause density (seconds of silence between segments, per second)
+- mean audio RMS energy and share of loud peaks, from the PCM envelope
+- keyword hits per second (keywords may be phrases of several words)
+- duration
+
+Rates are shrunk towards the video's overall rate (RATE_PRIOR_SECONDS), and
+the duration term adds a mild preference for longer windows, so the noisier
+rates of short windows don't put every pick at the short end of the range.
+
+Features are z-scored across candidates and combined with weights. The
+best non-overlapping windows are then picked greedily. Overall it's
+O(n log n) in the number of segments.
+"""
+import bisect
+import re
+
+import numpy as np
+
+ENVELOPE_HOP_SECONDS = 0.1
+PEAK_PERCENTILE = 90 # Envelope frames above this percentile count as loudness peaks
+PAUSE_MIN_SECONDS = 0.3 # Shorter gaps are just Whisper segmentation, not pauses
+CANDIDATE_LENGTHS = 8 # Window lengths tried per first segment, min to max duration
+# Rates are shrunk towards the transcript-wide rate as if every window had this
+# many seconds of average speech added: a short window needs a stronger signal
+# than a long one to rank as high, instead of winning on noise
+RATE_PRIOR_SECONDS = 10.0
+
+DEFAULT_WEIGHTS = {
+    "words_per_second": 1.0,
+    "pause_density": -0.75,
+    "energy": 0.75,
+    "peak_rate": 0.5,
+    "keyword_rate": 1.5,
+    "duration": 0.25,
+}
+
+WORD_RE = re.compile(r"[\w']+")
+
+
+def rms_envelope(audio, sample_rate, hop_seconds=ENVELOPE_HOP_SECONDS):
+    # Per-hop RMS of the PCM; ~10 values per second is plenty for scoring
+    hop = max(1, int(sample_rate * hop_seconds))
+    n_frames = len(audio) // hop
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:n_frames * hop].reshape(n_frames, hop)
+    return np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+
+
+def _prefix(values):
+    out = np.zeros(len(values) + 1, dtype=np.float64)
+    np.cumsum(values, out=out[1:])
+    return out
+
+
+def keyword_phrases(keywords):
+    # {length in tokens: keywords}, tokenised like the transcript; single
+    # words as strings, phrases as token tuples
+    phrases = {}
+    for keyword in keywords:
+        tokens = tuple(WORD_RE.findall(keyword.lower()))
+        if tokens:
+            phrases.setdefault(len(tokens), set()).add(tokens[0] if len(tokens) == 1 else tokens)
+    return phrases
+
+
+def count_phrases(tokens, phrases):
+    # Occurrences in `tokens` of any keyword from keyword_phrases()
+    hits = 0
+    for length, group in phrases.items():
+        if length == 1:
+            hits += sum(token in group for token in tokens)
+        else:
+            hits += sum(tuple(tokens[i:i + length]) in group for i in range(len(tokens) - length + 1))
+    return hits
+
+
+def _zscore(values):
+    std = values.std()
+    return (values - values.mean()) / std if std > 0 else np.zeros_like(values)
+
+
+def score_windows(segments, min_duration=10.0, max_duration=60.0, num_clips=3,
+                  envelope=None, hop_seconds=ENVELOPE_HOP_SECONDS, keywords=(), weights=None):
+    # Returns up to `num_clips` non-overlapping windows, best first:
+    # [{"start", "end", "duration", "score", "text", "features"}, ...]
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    segments = sorted(segments, key=lambda s: s["start"])
+    n = len(segments)
+    if n == 0:
+        return []
+
+    starts = np.array([s["start"] for s in segments], dtype=np.float64)
+    ends = np.maximum.accumulate(np.array([s["end"] for s in segments], dtype=np.float64))
+    # Phrases are matched within a segment, not across segment boundaries
+    phrases = keyword_phrases(keywords)
+    words = np.zeros(n)
+    hits = np.zeros(n)
+    for i, segment in enumerate(segments):
+        tokens = WORD_RE.findall(str(segment["text"]).lower())
+        words[i] = len(tokens)
+        if phrases:
+            hits[i] = count_phrases(tokens, phrases)
+    gaps = np.zeros(n)
+    gaps[1:] = np.clip(starts[1:] - ends[:-1], 0.0, None)
+    gaps[gaps < PAUSE_MIN_SECONDS] = 0.0
+    words_prefix, hits_prefix, gaps_prefix = _prefix(words), _prefix(hits), _prefix(gaps)
+
+    # Candidates: for each first segment i, the shortest run i..j reaching
+    # each target length, plus the longest run that still fits the range
+    # (binary searches on `ends`). A row of `last` never decreases, so runs
+    # found for two targets are next to each other and kept once.
+    first = np.arange(n)
+    j_long = np.minimum(np.searchsorted(ends, starts + max_duration, side="right") - 1, n - 1)
+    targets = np.linspace(min_duration, max_duration, CANDIDATE_LENGTHS)
+    last = np.searchsorted(ends, starts[:, None] + targets[None, :], side="left")
+    last = np.concatenate([np.minimum(last, j_long[:, None]), j_long[:, None]], axis=1)
+    valid = (last >= first[:, None]) & (ends[np.clip(last, 0, n - 1)] - starts[:, None] >= min_duration)
+    valid[:, 1:] &= last[:, 1:] != last[:, :-1]
+    if not valid.any():
+        return []
+    cand_first = np.broadcast_to(first[:, None], last.shape)[valid]
+    cand_last = last[valid]
+    cand_start = starts[cand_first]
+    cand_end = ends[cand_last]
+    duration = cand_end - cand_start
+    total_seconds = max(ends[-1] - starts[0], 1e-9)
+
+    def rate(window_sums, total):
+        return (window_sums + total / total_seconds * RATE_PRIOR_SECONDS) / (duration + RATE_PRIOR_SECONDS)
+
+    # Gaps are attributed to the segment after them, so skip the first one's gap
+    features = {
+        "words_per_second": rate(words_prefix[cand_last + 1] - words_prefix[cand_first], words_prefix[-1]),
+        "pause_density": rate(gaps_prefix[cand_last + 1] - gaps_prefix[cand_first + 1], gaps_prefix[-1]),
+        "keyword_rate": rate(hits_prefix[cand_last + 1] - hits_prefix[cand_first], hits_prefix[-1]),
+        "duration": duration,
+    }
+    if envelope is not None and len(envelope):
+        envelope = np.asarray(envelope, dtype=np.float64)
+        peaks = envelope > np.percentile(envelope, PEAK_PERCENTILE)
+        energy_prefix, peaks_prefix = _prefix(envelope), _prefix(peaks)
+        lo = np.clip((cand_start / hop_seconds).astype(np.int64), 0, len(envelope))
+        hi = np.clip((cand_end / hop_seconds).astype(np.int64), 0, len(envelope))
+        frames = np.maximum(hi - lo, 1)
+        features["energy"] = (energy_prefix[hi] - energy_prefix[lo]) / frames
+        features["peak_rate"] = rate(peaks_prefix[hi] - peaks_prefix[lo], peaks_prefix[-1])
+
+    score = np.zeros(len(cand_first))
+    for name, values in features.items():
+        score += weights.get(name, 0.0) * _zscore(values)
+
+    # Greedy top-K without overlaps: accepted windows kept sorted by start
+    picked, picked_starts = [], []
+    for c in np.argsort(-score, kind="stable"):
+        if len(picked) == num_clips:
+            break
+        start, end = cand_start[c], cand_end[c]
+        pos = bisect.bisect_left(picked_starts, start)
+        if pos > 0 and picked[pos - 1][1] > start:
+            continue
+        if pos < len(picked) and picked[pos][0] < end:
+            continue
+        picked.insert(pos, (start, end, c))
+        picked_starts.insert(pos, start)
+
+    picked.sort(key=lambda p: -score[p[2]])
+    return [
+        {
+            "start": float(start),
+            "end": float(end),
+            "duration": float(end - start),
+            "score": float(score[c]),
+            "text": " ".join(str(s["text"]).strip() for s in segments[cand_first[c]:cand_last[c] + 1]),
+            "features": {name: float(values[c]) for name, values in features.items()},
+        }
+        for start, end, c in picked
+    ]
@@ -0,0 +1,46 @@
+"""Interval index over Whisper transcript segments.
+
+Built once per transcription and kept in session state, so caption lookup
+for a clip is two binary searches plus a scan of the hits instead of
+sorting and scanning every segment of the transcript for every clip.
+"""
+import numpy as np
+
+
+class SegmentIndex:
+    def __init__(self, segments):
+        # Empty captions are dropped up front, the rest are sorted by start time
+        rows = sorted(
+            (float(s["start"]), float(s["end"]), str(s["text"]).strip())
+            for s in segments
+            if str(s["text"]).strip()
+        )
+        self.starts = np.array([r[0] for r in rows], dtype=np.float64)
+        self.ends = np.array([r[1] for r in rows], dtype=np.float64)
+        self.texts = [r[2] for r in rows]
+        # Running max of the end times is monotonic, which lets us binary
+        # search for the first segment that can still reach clip_start
+        self.max_ends = np.maximum.accumulate(self.ends) if rows else self.ends
+
+    def __len__(self):
+        return len(self.texts)
+
+    def overlapping(self, clip_start, clip_end):
+        # Indices of segments with start < clip_end and end > clip_start
+        hi = int(np.searchsorted(self.starts, clip_end, side="left"))
+        lo = int(np.searchsorted(self.max_ends, clip_start, side="right"))
+        if lo >= hi:
+            return np.empty(0, dtype=np.intp)
+        return lo + np.flatnonzero(self.ends[lo:hi] > clip_start)
+
+    def query(self, clip_start, clip_end):
+        # Captions for a clip, trimmed to it and relative to its start:
+        # [(relative_start, relative_end, text), ...]
+        idx = self.overlapping(clip_start, clip_end)
+        relative_starts = np.maximum(self.starts[idx], clip_start) - clip_start
+        relative_ends = np.minimum(self.ends[idx], clip_end) - clip_start
+        return [
+            (float(start), float(end), self.texts[i])
+            for i, start, end in zip(idx.tolist(), relative_starts, relative_ends)
+            if end > start # Skip zero-duration
+        ]
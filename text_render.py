@@ -0,0 +1,84 @@
+"""Text overlays for PixelPy.
+
+Fonts are loaded once per (font, size). A text's glyphs are rasterised
+once per (text, font, size, outline width) into two small masks, fill and
+fill+outline, covering only the text's bounding box. The outline comes from
+Pillow's stroke_width/stroke_fill in the same pass. Colours are applied to
+those masks (also cached), and the coloured layer is alpha-composited onto
+the image at the requested position. So moving the text or changing its
+colour never re-rasterises glyphs, and only the text's box of a large photo
+is touched.
+"""
+import math
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+DEFAULT_FONT = "arial.ttf"
+OUTLINE_COLOR = (0, 0, 0) # Black
+OUTLINE_WIDTH = 2
+PREVIEW_MAX_SIDE = 1280 # Live previews are drawn on a copy this size at most
+PNG_COMPRESS_LEVEL = 1 # Much faster than the default 6 on large images, slightly bigger files
+
+
+@lru_cache(maxsize=32)
+def load_font(font_size, font_path=DEFAULT_FONT):
+    # Returns (font, found); falls back to Pillow's built-in font
+    try:
+        return ImageFont.truetype(font_path, font_size), True
+    except OSError:
+        try:
+            return ImageFont.load_default(font_size), False # Scalable since Pillow 10.1
+        except TypeError:
+            return ImageFont.load_default(), False
+
+
+@lru_cache(maxsize=64)
+def text_masks(text, font_size, stroke_width=OUTLINE_WIDTH, font_path=DEFAULT_FONT):
+    # (fill mask, fill+outline mask, (left, top)): the masks cover the text's
+    # box and (left, top) is that box's offset from the "mm" anchor point
+    font, _ = load_font(font_size, font_path)
+    measure = ImageDraw.Draw(Image.new("L", (1, 1)))
+    left, top, right, bottom = measure.textbbox((0, 0), text, font=font, anchor="mm", stroke_width=stroke_width)
+    left, top, right, bottom = math.floor(left), math.floor(top), math.ceil(right), math.ceil(bottom)
+    size = (max(1, right - left), max(1, bottom - top))
+    fill_mask = Image.new("L", size, 0)
+    ImageDraw.Draw(fill_mask).text((-left, -top), text, font=font, fill=255, anchor="mm")
+    outline_mask = Image.new("L", size, 0)
+    ImageDraw.Draw(outline_mask).text((-left, -top), text, font=font, fill=255, anchor="mm",
+                                      stroke_width=stroke_width, stroke_fill=255)
+    return fill_mask, outline_mask, (left, top)
+
+
+@lru_cache(maxsize=64)
+def text_layer(text, font_size, fill, stroke_fill=OUTLINE_COLOR, stroke_width=OUTLINE_WIDTH, font_path=DEFAULT_FONT):
+    # Coloured RGBA layer of the text plus its (left, top) offset; colours
+    # must be hashable (e.g. "#RRGGBB" or a tuple)
+    fill_mask, outline_mask, offset = text_masks(text, font_size, stroke_width, font_path)
+    layer = Image.composite(Image.new("RGBA", fill_mask.size, fill),
+                            Image.new("RGBA", fill_mask.size, stroke_fill), fill_mask)
+    layer.putalpha(outline_mask)
+    return layer, offset
+
+
+def draw_text(image, text, xy, font_size, fill, stroke_fill=OUTLINE_COLOR, stroke_width=OUTLINE_WIDTH,
+              font_path=DEFAULT_FONT):
+    # Copy of the RGBA `image` with `text` centred on `xy`
+    layer, (left, top) = text_layer(text, font_size, fill, stroke_fill, stroke_width, font_path)
+    result = image.copy()
+    x, y = int(xy[0]) + left, int(xy[1]) + top
+    # alpha_composite wants a destination inside the image: clip the layer's
+    # top/left overhang here, Pillow clips the bottom/right itself
+    source = (max(0, -x), max(0, -y))
+    if source[0] < layer.width and source[1] < layer.height and x < result.width and y < result.height:
+        result.alpha_composite(layer, dest=(max(0, x), max(0, y)), source=source)
+    return result
+
+
+def preview_copy(image, max_side=PREVIEW_MAX_SIDE):
+    # (downscaled copy, scale) for live previews of large images
+    scale = min(1.0, max_side / max(image.size))
+    if scale == 1.0:
+        return image, scale
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.Resampling.LANCZOS), scale
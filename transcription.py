@@ -0,0 +1,186 @@
+"""Transcription helpers for the clip generator.
+
+Long audio is split at pauses found by a simple energy-based voice activity
+detector, the chunks are transcribed in parallel worker processes (one
+backend model per worker, see whisper_backends) and the segments are shifted back onto the
+original timeline and yielded in order, a chunk at a time, as soon as each chunk is done.
+The transcribe job publishes the transcript so far as a partial cache entry
+after every chunk, so the UI can show it live.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from disk_cache import DEFAULT_CACHE_ROOT, DiskLRUCache, make_key
+from media import WHISPER_SAMPLE_RATE
+from whisper_backends import load_backend
+
+TRANSCRIPT_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512 MiB of transcripts
+
+# Chunking: cut at the quietest point between MIN and MAX seconds into a chunk
+CHUNK_MIN_SECONDS = 30.0
+CHUNK_MAX_SECONDS = 90.0
+VAD_FRAME_SECONDS = 0.03
+VAD_SMOOTH_FRAMES = 10 # ~0.3 s, so a real pause beats a gap between two words
+SILENCE_RMS = 0.005 # Chunks that never get louder than this are skipped
+
+
+def compact_segments(segments):
+    # Keep only what the app uses; Whisper's extra fields (tokens, logprobs)
+    # bloat the cache and may hold numpy scalars that JSON can't encode.
+    return [
+        {"start": float(s["start"]), "end": float(s["end"]), "text": str(s["text"])}
+        for s in segments
+    ]
+
+
+class TranscriptionCache:
+    # Content-addressed: the key only depends on the uploaded bytes and on the
+    # settings that change Whisper's output, never on temp paths or file names.
+    def __init__(self, root=None, max_bytes=TRANSCRIPT_CACHE_MAX_BYTES):
+        root = root or os.path.join(DEFAULT_CACHE_ROOT, "transcripts")
+        self.store = DiskLRUCache(root, max_bytes)
+
+    # `model` is any JSON-serialisable model description, e.g. a
+    # whisper_backends config dict
+    @staticmethod
+    def key(video_hash, model, options):
+        return make_key("transcript", video_hash, model, options or {})
+
+    def get(self, video_hash, model, options=None):
+        return self.store.get_json(self.key(video_hash, model, options))
+
+    def put(self, video_hash, model, options, segments):
+        self.store.put_json(self.key(video_hash, model, options), compact_segments(segments))
+        self.store.delete(self.partial_key(video_hash, model, options), ".json")
+
+    # Transcript so far of a transcription that is still running
+    @staticmethod
+    def partial_key(video_hash, model, options):
+        return make_key("partial_transcript", video_hash, model, options or {})
+
+    def get_partial(self, video_hash, model, options=None):
+        return self.store.get_json(self.partial_key(video_hash, model, options))
+
+    def put_partial(self, video_hash, model, options, segments):
+        self.store.put_json(self.partial_key(video_hash, model, options), compact_segments(segments))
+
+    # Loudness envelope for clip scoring; like the transcript it only depends
+    # on the uploaded bytes, so it's computed once by the transcribe job
+    @staticmethod
+    def envelope_key(video_hash, hop_seconds):
+        return make_key("envelope", video_hash, hop_seconds)
+
+    def get_envelope(self, video_hash, hop_seconds):
+        return self.store.get_json(self.envelope_key(video_hash, hop_seconds))
+
+    def put_envelope(self, video_hash, hop_seconds, envelope):
+        values = [round(float(v), 5) for v in envelope]
+        self.store.put_json(self.envelope_key(video_hash, hop_seconds), values)
+
+
+# --- Voice activity based chunking ---
+def frame_energy(audio, sample_rate=WHISPER_SAMPLE_RATE, frame_seconds=VAD_FRAME_SECONDS):
+    # Smoothed RMS per frame
+    frame = max(1, int(sample_rate * frame_seconds))
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32), frame
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    energy = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+    if n_frames >= VAD_SMOOTH_FRAMES:
+        energy = np.convolve(energy, np.ones(VAD_SMOOTH_FRAMES) / VAD_SMOOTH_FRAMES, mode="same")
+    return energy, frame
+
+
+def vad_chunks(audio, sample_rate=WHISPER_SAMPLE_RATE,
+               min_seconds=CHUNK_MIN_SECONDS, max_seconds=CHUNK_MAX_SECONDS):
+    # [(start_sample, end_sample), ...] covering the audio, each cut placed
+    # at the quietest frame between min_seconds and max_seconds into the chunk.
+    # Chunks that are silence from end to end are left out.
+    energy, frame = frame_energy(audio, sample_rate)
+    min_frames = max(1, int(min_seconds * sample_rate / frame))
+    max_frames = max(min_frames + 1, int(max_seconds * sample_rate / frame))
+
+    bounds, start = [], 0
+    while len(energy) - start > max_frames:
+        window = energy[start + min_frames:start + max_frames]
+        cut = start + min_frames + int(np.argmin(window))
+        bounds.append((start, cut))
+        start = cut
+    bounds.append((start, len(energy)))
+
+    chunks = []
+    for first, last in bounds:
+        end_sample = len(audio) if last == len(energy) else last * frame
+        if end_sample <= first * frame:
+            continue
+        if last > first and energy[first:last].max() < SILENCE_RMS:
+            continue
+        chunks.append((first * frame, end_sample))
+    return chunks
+
+
+# --- Parallel transcription ---
+_worker_backend = None
+_worker_error = None
+
+
+def _load_worker_backend(backend_config, threads):
+    # Pool initializer: each worker loads its own model exactly once. An
+    # exception here would only break the pool ("terminated abruptly"), so
+    # it is kept and raised from the worker's chunks instead
+    global _worker_backend, _worker_error
+    try:
+        _worker_backend = load_backend(backend_config, threads)
+    except Exception as e:
+        _worker_error = RuntimeError(f"Could not load the {backend_config.get('backend')} "
+                                     f"'{backend_config.get('model_size')}' model: {e}")
+
+
+def _transcribe_chunk(audio, offset, options):
+    if _worker_error is not None:
+        raise _worker_error
+    # Shift onto the original timeline
+    return [
+        {"start": s["start"] + offset, "end": s["end"] + offset, "text": s["text"]}
+        for s in _worker_backend.transcribe(audio, **options)
+    ]
+
+
+def default_transcribe_workers():
+    # Each engine already uses several threads per model, so keep a few per worker
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+def iter_transcribe(audio, backend_config, options=None, workers=None, sample_rate=WHISPER_SAMPLE_RATE):
+    # Yields (chunk's segments, seconds_transcribed) in timeline order, as
+    # soon as the chunk and every earlier one are finished
+    options = options or {}
+    workers = workers or default_transcribe_workers()
+    chunks = vad_chunks(audio, sample_rate)
+    if not chunks:
+        return
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    ctx = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=ctx,
+                               initializer=_load_worker_backend, initargs=(backend_config, threads))
+    try:
+        futures = [
+            pool.submit(_transcribe_chunk, audio[start:end], start / sample_rate, options)
+            for start, end in chunks
+        ]
+        for future, (_, end) in zip(futures, chunks):
+            yield future.result(), end / sample_rate
+    finally:
+        # Also runs when the consumer stops early (generator closed): chunks
+        # that have not started are dropped instead of transcribed for nothing
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def chunking_options():
+    # Chunk boundaries change Whisper's output, so they belong in the cache key
+    return {"chunk_min": CHUNK_MIN_SECONDS, "chunk_max": CHUNK_MAX_SECONDS, "vad_frame": VAD_FRAME_SECONDS}
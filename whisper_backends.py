@@ -0,0 +1,96 @@
+"""Pluggable speech-to-text backends for the clip generator.
+
+Every backend takes 16 kHz mono float32 audio and returns plain
+{"start", "end", "text"} segment dicts, so the rest of the pipeline (chunking,
+caching, captions) does not care which engine produced them. Engines are
+imported lazily; only the ones actually installed are offered in the UI.
+"""
+import importlib.util
+
+MODEL_SIZES = ["tiny", "base", "small", "medium", "large-v3"]
+
+
+class WhisperBackend:
+    name = None
+    module = None # Import name used to check availability
+    compute_types = []
+
+    def __init__(self, model_size="base", compute_type=None, threads=None):
+        self.model_size = model_size
+        self.compute_type = compute_type or self.compute_types[0]
+        self.threads = threads
+        if self.compute_type not in self.compute_types:
+            raise ValueError(f"{self.name} does not support compute type '{self.compute_type}'")
+
+    @classmethod
+    def is_available(cls):
+        return importlib.util.find_spec(cls.module) is not None
+
+    def transcribe(self, audio, **options):
+        raise NotImplementedError
+
+
+class OpenAIWhisperBackend(WhisperBackend):
+    # Reference PyTorch implementation. "int8" applies dynamic quantization
+    # to the Linear layers, which is where nearly all CPU time goes.
+    name = "openai-whisper"
+    module = "whisper"
+    compute_types = ["float32", "int8"]
+
+    def __init__(self, model_size="base", compute_type=None, threads=None):
+        super().__init__(model_size, compute_type, threads)
+        import torch
+        import whisper
+        if threads:
+            torch.set_num_threads(threads)
+        model = whisper.load_model(model_size, device="cpu")
+        if self.compute_type == "int8":
+            # Whisper's layers are a Linear subclass, and quantize_dynamic (and
+            # the quantized Linear's from_float) only match the exact type. The
+            # subclass only casts weights to the input dtype, a no-op in float32.
+            for module in model.modules():
+                if type(module) is whisper.model.Linear:
+                    module.__class__ = torch.nn.Linear
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+
+    def transcribe(self, audio, **options):
+        options.setdefault("fp16", False) # fp16 is GPU-only; avoids a warning per call
+        result = self.model.transcribe(audio, **options)
+        return [{"start": s["start"], "end": s["end"], "text": s["text"]} for s in result["segments"]]
+
+
+class FasterWhisperBackend(WhisperBackend):
+    # CTranslate2 runtime with int8 kernels; usually the best throughput on CPU
+    name = "faster-whisper"
+    module = "faster_whisper"
+    compute_types = ["int8", "int8_float32", "float32"]
+
+    def __init__(self, model_size="base", compute_type=None, threads=None):
+        super().__init__(model_size, compute_type, threads)
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model_size, device="cpu", compute_type=self.compute_type,
+                                  cpu_threads=threads or 0)
+
+    def transcribe(self, audio, **options):
+        segments, _ = self.model.transcribe(audio, **options)
+        return [{"start": s.start, "end": s.end, "text": s.text} for s in segments]
+
+
+BACKENDS = {backend.name: backend for backend in (OpenAIWhisperBackend, FasterWhisperBackend)}
+
+DEFAULT_BACKEND_CONFIG = {"backend": "openai-whisper", "model_size": "base", "compute_type": "float32"}
+
+
+def available_backends():
+    return [name for name, backend in BACKENDS.items() if backend.is_available()]
+
+
+def load_backend(config, threads=None):
+    # `config` is a {"backend", "model_size", "compute_type"} dict; it is also
+    # used as part of the transcript cache key
+    try:
+        backend = BACKENDS[config["backend"]]
+    except KeyError:
+        raise ValueError(f"Unknown transcription backend '{config['backend']}'") from None
+    return backend(config["model_size"], config.get("compute_type"), threads)